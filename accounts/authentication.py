@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+
+
+User = get_user_model()
+
+# Whether a user may still use the tokens issued to them, kept in the cache for AUTH_USER_STATE_TIMEOUT seconds
+# and forgotten as soon as the user is saved or deleted (see accounts/signals.py)
+USER_STATE_KEY_PREFIX = "auth:user-state"
+
+
+def _user_state_key(user_id):
+    return f"{USER_STATE_KEY_PREFIX}:{user_id}"
+
+
+def get_user_state(user_id):
+    """(is_active, is_staff) of a user, (False, False) when it no longer exists."""
+    key = _user_state_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = User.objects.filter(pk=user_id).values_list("is_active", "is_staff").first() or (False, False)
+        cache.set(key, state, settings.AUTH_USER_STATE_TIMEOUT)
+    return state
+
+
+def forget_user_state(user_id):
+    cache.delete(_user_state_key(user_id))
+
+
+class ClaimsUser(TokenUser):
+    """
+    The user of a request authenticated by its access token: id, username and is_staff are read from the claims
+    added by accounts.tokens.add_user_claims. The User row is only loaded when anything else is read from it.
+    Use the ids (owner_id=user.pk) rather than the instance to filter or assign foreign keys.
+    """
+
+    def __str__(self):
+        return f"{self.pk} --- {self.username}"
+
+    @cached_property
+    def user(self):
+        return User.objects.get(pk=self.pk)
+
+    def __getattr__(self, attr):
+        if attr.startswith("_") or "token" not in self.__dict__:
+            raise AttributeError(attr)
+        return getattr(self.user, attr)
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.pk == other.pk
+        return super().__eq__(other)
+
+    __hash__ = TokenUser.__hash__
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Authenticates JWT access tokens without loading the user row. Deactivated users, and staff members who lost
+    their rights, are turned away through a short-lived cache of their state instead.
+    """
+
+    def get_user(self, validated_token):
+        user = super().get_user(validated_token)
+        is_active, is_staff = get_user_state(user.pk)
+        if not is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        if user.is_staff and not is_staff:
+            raise AuthenticationFailed("User permissions have changed, log in again", code="user_changed")
+        return user
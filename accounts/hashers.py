@@ -0,0 +1,15 @@
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2id with 19 MiB of memory, 2 passes and a single lane, the minimum recommended by OWASP. It costs a
+    fraction of the CPU time of PBKDF2 at Django's iteration count while staying expensive to brute force on GPUs,
+    and leaves the worker threads free for other requests.
+
+    The algorithm name is unchanged: passwords hashed with other parameters, or by the hashers listed after this
+    one in PASSWORD_HASHERS, are rehashed with these on the user's next successful login.
+    """
+    time_cost = 2
+    memory_cost = 19 * 1024
+    parallelism = 1
@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from rest_framework.validators import ValidationError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from .models import User
+from .tokens import add_user_claims
 
 
 class SignUpSerializer(serializers.ModelSerializer):
@@ -21,15 +23,8 @@ class SignUpSerializer(serializers.ModelSerializer):
         return super().validate(attrs)
     
     def create(self, validated_data):
-        password = validated_data.pop("password")
-
-        user=super().create(validated_data)
-
-        user.set_password(password)
-
-        user.save()
-
-        return user
+        # Hashes the password before the single INSERT
+        return User.objects.create_user(**validated_data)
 
 
 class LoginSerializer(serializers.ModelSerializer):
@@ -38,3 +33,10 @@ class LoginSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["email", "password"]
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # Tokens from jwt/create carry the same claims as the ones from login
+    @classmethod
+    def get_token(cls, user):
+        return add_user_claims(super().get_token(user), user)
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import forget_user_state
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_saved_user_state(sender, instance, **kwargs):
+    # A deactivated or deleted user is turned away on their next request, not when the cached state expires
+    forget_user_state(instance.pk)
@@ -1,3 +1,161 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from store.models import Order, Product, Review
+from .models import User
+from .tokens import create_jwt_pair_for_user
 
 # Create your tests here.
+
+
+class ClaimsJWTAuthenticationTestCase(APITestCase):
+    """Access tokens are trusted for who the user is, the user row is only read back when needed."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+        self.other = User.objects.create_user(email="other@example.com", password="password", username="other")
+        Order.objects.create(owner=self.user)
+        Order.objects.create(owner=self.other)
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {create_jwt_pair_for_user(user)['access']}")
+
+    def user_queries(self, context):
+        return [query["sql"] for query in context.captured_queries if '"accounts_user"' in query["sql"]]
+
+    def test_tokens_carry_user_claims(self):
+        response = self.client.post(reverse("jwt_create"), {"email": "buyer@example.com", "password": "password"})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        response = self.client.get(reverse("order-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 1)
+
+    def test_user_row_is_not_loaded(self):
+        self.authenticate(self.user)
+        self.client.get(reverse("order-list"))
+        # The user state is cached after the first request
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("order-list"))
+        self.assertEqual(response.data["count"], 1)
+        self.assertEqual(self.user_queries(context), [])
+
+    def test_full_user_is_loaded_lazily(self):
+        self.authenticate(self.user)
+        request = self.client.get(reverse("order-list")).wsgi_request
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(request.user.email, "buyer@example.com")
+            self.assertEqual(request.user.email, "buyer@example.com")
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(request.user, self.user)
+
+    def test_deactivated_user_is_rejected(self):
+        self.authenticate(self.user)
+        self.assertEqual(self.client.get(reverse("order-list")).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("order-list")).status_code, 401)
+
+    def test_demoted_staff_is_rejected(self):
+        staff = User.objects.create_user(email="staff@example.com", password="password", username="staff", is_staff=True)
+        self.authenticate(staff)
+        self.assertEqual(self.client.get(reverse("order-list")).data["count"], 2)
+        staff.is_staff = False
+        staff.save()
+        self.assertEqual(self.client.get(reverse("order-list")).status_code, 401)
+
+    def test_review_author_permission(self):
+        product = Product.objects.create(name="Phone", description="-", inventory=1)
+        review = Review.objects.create(product=product, author=self.user, content="Good")
+        url = reverse("product-reviews-detail", args=[product.id, review.id])
+
+        self.authenticate(self.other)
+        self.assertEqual(self.client.delete(url).status_code, 403)
+        self.authenticate(self.user)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+
+    def test_anonymous_users_cannot_write_reviews(self):
+        product = Product.objects.create(name="Phone", description="-", inventory=1)
+        orphan = Review.objects.create(product=product, author=None, content="Imported")
+        self.assertIn(
+            self.client.delete(reverse("product-reviews-detail", args=[product.id, orphan.id])).status_code, (401, 403)
+        )
+        response = self.client.post(reverse("product-reviews-list", args=[product.id]), {"content": "Anonymous"})
+        self.assertIn(response.status_code, (401, 403))
+        self.assertEqual(Review.objects.count(), 1)
+
+
+class PasswordHashingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_signup_hashes_with_argon2_in_one_insert(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse("signup"), {"email": "new@example.com", "username": "new", "password": "secret-password"}
+            )
+        self.assertEqual(response.status_code, 200)
+        writes = [query["sql"] for query in context.captured_queries if query["sql"].startswith(("INSERT", "UPDATE"))]
+        self.assertEqual(len(writes), 1)
+        user = User.objects.get(email="new@example.com")
+        self.assertTrue(user.password.startswith("argon2$argon2id$v=19$m=19456,t=2,p=1$"))
+        self.assertTrue(user.check_password("secret-password"))
+
+    def test_legacy_hash_is_upgraded_on_login(self):
+        user = User.objects.create_user(email="old@example.com", password=None, username="old")
+        User.objects.filter(pk=user.pk).update(password=make_password("password", hasher="pbkdf2_sha256"))
+        response = self.client.post(reverse("login"), {"email": "old@example.com", "password": "password"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.objects.get(pk=user.pk).password.startswith("argon2$"))
+
+
+class LoginThrottleTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+
+    def login(self, email, password="wrong", **extra):
+        return self.client.post(reverse("login"), {"email": email, "password": password}, **extra)
+
+    def test_email_bucket_rejects_before_hashing(self):
+        for _ in range(5):
+            self.assertEqual(self.login("buyer@example.com").status_code, 400)
+        # Another address and another client, the account keeps being protected
+        with mock.patch("accounts.views.authenticate") as authenticate:
+            response = self.login("Buyer@Example.com", "password", REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        authenticate.assert_not_called()
+        self.assertEqual(self.login("other@example.com").status_code, 400)
+
+    def test_ip_bucket_refills(self):
+        with mock.patch("accounts.throttling.TokenBucketThrottle.timer", return_value=1000.0):
+            for index in range(20):
+                self.assertEqual(self.login(f"user{index}@example.com").status_code, 400)
+            self.assertEqual(self.login("user20@example.com").status_code, 429)
+        # 20/min: one attempt is allowed again after 3 seconds
+        with mock.patch("accounts.throttling.TokenBucketThrottle.timer", return_value=1003.0):
+            self.assertEqual(self.login("user21@example.com").status_code, 400)
+            self.assertEqual(self.login("user22@example.com").status_code, 429)
+
+    def test_ip_bucket_ignores_spoofed_forwarded_for(self):
+        for index in range(20):
+            self.login(f"user{index}@example.com", HTTP_X_FORWARDED_FOR=f"203.0.113.{index}")
+        response = self.login("user20@example.com", HTTP_X_FORWARDED_FOR="203.0.113.250")
+        self.assertEqual(response.status_code, 429)
+
+    def test_body_without_email(self):
+        response = self.client.post(reverse("login"), [1, 2], format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_jwt_create_is_throttled(self):
+        for _ in range(5):
+            self.client.post(reverse("jwt_create"), {"email": "buyer@example.com", "password": "wrong"})
+        response = self.client.post(reverse("jwt_create"), {"email": "buyer@example.com", "password": "password"})
+        self.assertEqual(response.status_code, 429)
@@ -0,0 +1,60 @@
+from rest_framework.throttling import ScopedRateThrottle
+
+
+class TokenBucketThrottle(ScopedRateThrottle):
+    """
+    Token bucket limiter for the views that hash passwords, checked before the view runs. A bucket holds as many
+    tokens as the rate allows per period ("5/min": 5 tokens, refilled at 5 a minute), so short bursts go through
+    and sustained traffic is held to the rate. Buckets live in the cache, one per ``<throttle_scope>_<suffix>``
+    scope and client.
+
+    Like the other DRF throttles the bucket is read and written without a lock, concurrent requests may let a
+    few extra attempts through.
+    """
+    scope_suffix = None
+
+    def allow_request(self, request, view):
+        scope = getattr(view, self.scope_attr, None)
+        if not scope:
+            return True
+        self.scope = f"{scope}_{self.scope_suffix}"
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        tokens, updated = self.cache.get(self.key, (self.num_requests, now))
+        self.tokens = min(self.num_requests, tokens + (now - updated) * self.num_requests / self.duration)
+        if self.tokens < 1:
+            return self.throttle_failure()
+        # An untouched bucket is full again after one period
+        self.cache.set(self.key, (self.tokens - 1, now), self.duration)
+        return self.throttle_success()
+
+    def throttle_success(self):
+        return True
+
+    def wait(self):
+        return (1 - self.tokens) * self.duration / self.num_requests
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    scope_suffix = "ip"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}
+
+
+class EmailTokenBucketThrottle(TokenBucketThrottle):
+    """Limits the attempts on one account, however many addresses they come from."""
+    scope_suffix = "email"
+
+    def get_cache_key(self, request, view):
+        # The body can be any JSON, not only an object
+        email = request.data.get("email") if isinstance(request.data, dict) else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        return self.cache_format % {"scope": self.scope, "ident": email.strip().lower()}
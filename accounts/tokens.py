@@ -5,8 +5,16 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 
+def add_user_claims(token, user: User):
+    # Read back by accounts.authentication.ClaimsUser instead of loading the user on every request.
+    # Copied to the access tokens created from a refresh token.
+    token["username"] = user.username
+    token["is_staff"] = user.is_staff
+    return token
+
+
 def create_jwt_pair_for_user(user: User):
-    refresh = RefreshToken.for_user(user)
+    refresh = add_user_claims(RefreshToken.for_user(user), user)
 
     tokens = {
         "access": str(refresh.access_token),
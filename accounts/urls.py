@@ -1,6 +1,5 @@
 from django.urls import path
 from rest_framework_simplejwt.views import (
-    TokenObtainPairView,
     TokenRefreshView,
     TokenVerifyView
 )
@@ -12,7 +11,7 @@ urlpatterns = [
     path("login/", views.LoginGenericView.as_view(), name="login"),
 
 
-    path("jwt/create/", TokenObtainPairView.as_view(), name="jwt_create"),
+    path("jwt/create/", views.ThrottledTokenObtainPairView.as_view(), name="jwt_create"),
     path("jwt/refresh/", TokenRefreshView.as_view(), name="jwt_refresh"),
     path("jwt/verify/", TokenVerifyView.as_view(), name="jwt_verify"),
 ]
\ No newline at end of file
@@ -4,9 +4,11 @@ from rest_framework.response import Response
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny
+from rest_framework_simplejwt.views import TokenObtainPairView
 
 from .models import User
 from .serializers import SignUpSerializer, LoginSerializer
+from .throttling import IPTokenBucketThrottle, EmailTokenBucketThrottle
 from .tokens import create_jwt_pair_for_user
 from drf_yasg.utils import swagger_auto_schema
 # Create your views here.
@@ -16,6 +18,8 @@ from drf_yasg.utils import swagger_auto_schema
 class SignUpView(generics.GenericAPIView):
     serializer_class = SignUpSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+    throttle_scope = "signup"
 
     def post(self, request: Request):
         data = request.data
@@ -37,6 +41,8 @@ class SignUpView(generics.GenericAPIView):
 
 class LoginView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+    throttle_scope = "login"
 
 
     def post(self, request: Request):
@@ -70,17 +76,18 @@ class LoginView(APIView):
 class LoginGenericView(generics.GenericAPIView):
     permission_classes = [AllowAny]
     serializer_class = LoginSerializer
+    throttle_classes = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+    throttle_scope = "login"
 
     @swagger_auto_schema(
             operation_summary="Login user"
     )
     def post(self, request: Request):
-        email = request.data.get("email")
-        password = request.data.get("password")
-
         serializer = self.serializer_class(data=request.data)
 
         if serializer.is_valid():
+            email = serializer.validated_data["email"]
+            password = serializer.validated_data["password"]
 
             user = authenticate(email=email, password=password)
 
@@ -98,4 +105,6 @@ class LoginGenericView(generics.GenericAPIView):
         return Response(data={"message":"Invalid email or password"}, status=status.HTTP_400_BAD_REQUEST)
 
 
-
+class ThrottledTokenObtainPairView(TokenObtainPairView):
+    throttle_classes = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+    throttle_scope = "login"
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe, urlencode
+from rest_framework import status
+from rest_framework.response import Response
+
+from .metrics import RESPONSE_CACHE
+
+
+# Catalog responses are cached under keys that embed version numbers. Writes never delete cached
+# responses, they bump the versions they affect (see api/signals.py) and stale keys simply expire:
+# - "categories": every category, and the category embedded in every product
+# - "products": every product list page
+# - "category:<pk>" / "product:<pk>": a single category or product
+
+VERSION_KEY_PREFIX = "api:version"
+RESPONSE_KEY_PREFIX = "api:response"
+# Validators set by ConditionalGetMixin, stored with the data so cache hits can answer 304s
+CACHED_HEADERS = ("ETag", "Last-Modified")
+
+
+def _version_key(name):
+    return f"{VERSION_KEY_PREFIX}:{name}"
+
+
+def get_versions(*names):
+    keys = [_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    return [versions.get(key, 0) for key in keys]
+
+
+def bump_versions(*names):
+    for name in names:
+        key = _version_key(name)
+        # add() is a no-op when the key exists, so the first bump of a new key is not lost to a race
+        if not cache.add(key, 1, timeout=None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(key, 1, timeout=None)
+
+
+def invalidate_categories(*pks):
+    names = ["categories", "products", *[f"category:{pk}" for pk in pks]]
+    # Once the write is visible: bumped earlier, a concurrent read would cache the old rows under the new versions
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+def invalidate_products(*pks):
+    names = ["products", *[f"product:{pk}" for pk in pks]]
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+class CachedResponseMixin:
+    """
+    Caches the list and retrieve responses of a public, read-mostly viewset per normalized URL.
+    Subclasses declare which versions their list and detail responses depend on.
+    """
+    list_cache_versions = ()
+    detail_cache_versions = ()
+
+    def get_cache_key(self, request, versions):
+        # Sorted parameters: ?a=1&b=2 and ?b=2&a=1 are the same response
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        return ":".join([
+            RESPONSE_KEY_PREFIX,
+            request.get_host(),
+            request.path,
+            request.accepted_renderer.format,
+            query,
+            *[str(version) for version in versions],
+        ])
+
+    def cached_response(self, request, version_names, render):
+        key = self.get_cache_key(request, get_versions(*version_names))
+        cached = cache.get(key)
+        RESPONSE_CACHE.labels("miss" if cached is None else "hit").inc()
+        if cached is not None:
+            data, headers = cached
+            # Conditional requests are answered from the cached validators, without touching the database
+            response = get_conditional_response(
+                request,
+                etag=headers.get("ETag"),
+                last_modified=parse_http_date_safe(headers.get("Last-Modified")),
+            ) or Response(data)
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+        response = render()
+        if response.status_code == status.HTTP_200_OK:
+            headers = {header: response[header] for header in CACHED_HEADERS if header in response}
+            cache.set(key, (response.data, headers), settings.API_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        render = super().list
+        return self.cached_response(request, self.list_cache_versions, lambda: render(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        render = super().retrieve
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        versions = [name.format(pk=pk) for name in self.detail_cache_versions]
+        return self.cached_response(request, versions, lambda: render(request, *args, **kwargs))
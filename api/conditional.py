@@ -0,0 +1,89 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+
+
+def version_headers(request, last_modified, *parts):
+    """Strong ETag and Last-Modified for a response identified by the request and its version stamp."""
+    key = "|".join(str(part) for part in [
+        request.get_full_path(),
+        request.accepted_renderer.format,
+        request.user.pk,
+        last_modified.isoformat(),
+        *parts,
+    ])
+    return {
+        "ETag": f'"{hashlib.sha1(key.encode()).hexdigest()}"',
+        "Last-Modified": http_date(last_modified.timestamp()),
+    }
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified headers to list and retrieve responses, derived from the ``updated_at``
+    version stamps of the queryset. A client that sends back If-None-Match/If-Modified-Since and is up to
+    date gets a 304 before anything is serialized: after one cheap query for an object, after the queries of
+    the page for a paginated list, which are then reused to render it.
+    """
+
+    def get_version_queryset(self):
+        # Override to drop annotations and prefetches that the version stamp does not need
+        return self.filter_queryset(self.get_queryset())
+
+    def get_list_version(self):
+        stamp = self.get_version_queryset().order_by().aggregate(last_modified=Max("updated_at"), count=Count("pk"))
+        return stamp["last_modified"], stamp["count"]
+
+    def get_page_version(self, page):
+        # The rows of the page, and the total count when the page shows one. Aggregating every row of the
+        # queryset instead would scan all of them on every request, 304s included
+        if not page:
+            return None, None
+        django_page = getattr(self.paginator, "page", None)
+        count = django_page.paginator.count if django_page is not None else None
+        return max(item.updated_at for item in page), f"{count}|{','.join(str(item.pk) for item in page)}"
+
+    def get_object_version(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            versions = self.get_version_queryset().filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+            return versions.values_list("updated_at", flat=True).first(), None
+        except (TypeError, ValueError, ValidationError):
+            # Malformed lookup, let retrieve() answer with its 404
+            return None, None
+
+    def conditional_response(self, request, version, render):
+        last_modified, extra = version
+        if last_modified is None:
+            return render()
+
+        headers = version_headers(request, last_modified, extra)
+        response = get_conditional_response(
+            request, etag=headers["ETag"], last_modified=int(last_modified.timestamp())
+        )
+        if response is None:
+            response = render()
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            for header, value in headers.items():
+                response[header] = value
+        return response
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator is None:
+            render = super().list
+            return self.conditional_response(request, self.get_list_version(), lambda: render(request, *args, **kwargs))
+
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+
+        def render():
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        return self.conditional_response(request, self.get_page_version(page), render)
+
+    def retrieve(self, request, *args, **kwargs):
+        render = super().retrieve
+        return self.conditional_response(request, self.get_object_version(), lambda: render(request, *args, **kwargs))
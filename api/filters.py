@@ -1,5 +1,9 @@
+from django.db import models
+from django_filters import NumberFilter
 from django_filters.rest_framework import FilterSet
+from rest_framework.filters import OrderingFilter, SearchFilter
 from store.models import Product
+from store.search import search_products
 
 
 class ProductFilter(FilterSet):
@@ -8,4 +12,30 @@ class ProductFilter(FilterSet):
         fields = {
             "category_id": ["exact"],
             "old_price": ["gt", "lt"],
+            "price": ["gt", "lt"],
         }
+        # price is a database generated column, filtered like any other number
+        filter_overrides = {
+            models.GeneratedField: {"filter_class": NumberFilter},
+        }
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Drop-in replacement for SearchFilter on products, backed by the full-text index of store/search.py.
+    Results are ranked by relevance unless the client asks for an explicit ordering.
+    Falls back to SearchFilter's icontains lookups on databases without a full-text index.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        results = search_products(queryset, " ".join(terms))
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+
+        if OrderingFilter.ordering_param in request.query_params:
+            return results
+        return results.order_by("-search_rank", *results.query.order_by)
@@ -0,0 +1,91 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import status
+from rest_framework.response import Response
+
+
+# Clients that retry a POST send the same Idempotency-Key header with every attempt. The first attempt runs
+# and its response is cached under the key; retries get that response back without running the view again.
+# Keys are scoped to the user and the URL, and remember a fingerprint of the body so a key cannot be reused
+# for a different request.
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_PREFIX = "api:idempotency"
+MAX_KEY_LENGTH = 255
+# How long a key stays locked while its first request runs, so a crashed worker does not block it for good
+LOCK_TIMEOUT = 60
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f"{request.method}|{request.path}|{body}".encode()).hexdigest()
+
+
+class IdempotentCreateMixin:
+    """
+    Makes create() idempotent for requests that carry an Idempotency-Key header. Responses are replayed for
+    IDEMPOTENCY_KEY_TIMEOUT seconds. Requests rejected with an exception (validation errors included) or
+    failing with a server error are not stored, so the client can retry them.
+    """
+
+    def get_idempotency_cache_key(self, request, key):
+        return ":".join([IDEMPOTENCY_KEY_PREFIX, str(request.user.pk), request.path, key])
+
+    def create(self, request, *args, **kwargs):
+        return self.idempotent_response(request, lambda: super(IdempotentCreateMixin, self).create(request, *args, **kwargs))
+
+    def idempotent_response(self, request, render):
+        """Run ``render`` once per Idempotency-Key, for other POST actions of the viewset."""
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return render()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"detail": f"{IDEMPOTENCY_HEADER} must be between 1 and {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        cache_key = self.get_idempotency_cache_key(request, key)
+        fingerprint = request_fingerprint(request)
+
+        # add() only succeeds for the first request with this key, concurrent retries see its entry
+        if not cache.add(cache_key, {"fingerprint": fingerprint, "response": None}, LOCK_TIMEOUT):
+            return self.replay(cache.get(cache_key), fingerprint)
+
+        try:
+            response = render()
+        except Exception:
+            cache.delete(cache_key)
+            raise
+
+        if response.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+            cache.delete(cache_key)
+        else:
+            stored = {"fingerprint": fingerprint, "response": (response.data, response.status_code)}
+            cache.set(cache_key, stored, settings.IDEMPOTENCY_KEY_TIMEOUT)
+        return response
+
+    def replay(self, entry, fingerprint):
+        if entry is None:
+            # The first request failed or its lock expired in the meantime
+            return Response(
+                {"detail": "A request with this Idempotency-Key did not complete, retry it."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        if entry["fingerprint"] != fingerprint:
+            return Response(
+                {"detail": f"This {IDEMPOTENCY_HEADER} was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if entry["response"] is None:
+            return Response(
+                {"detail": "A request with this Idempotency-Key is still being processed."},
+                status=status.HTTP_409_CONFLICT,
+                headers={"Retry-After": "1"},
+            )
+        data, status_code = entry["response"]
+        return Response(data, status=status_code, headers={"Idempotent-Replayed": "true"})
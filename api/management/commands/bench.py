@@ -0,0 +1,249 @@
+import json
+import platform
+import random
+import subprocess
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.metrics import QueryCounter
+from api.testing import seed_catalog
+from store.models import Category, Product
+
+
+User = get_user_model()
+
+SCENARIOS = ["browse", "search", "cart", "checkout"]
+DEFAULT_MIX = "browse=60,search=20,cart=15,checkout=5"
+# The run gets a cache of its own like it gets a database of its own: the configured one may be the shared Redis,
+# with the carts, idempotency records and throttle buckets of the live site
+BENCH_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "bench"}}
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise CommandError(f"Unknown scenario {name!r}, choose from {', '.join(SCENARIOS)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight for {name}: {weight!r}")
+    return mix
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile of sorted ``values``."""
+    return values[min(len(values) - 1, int(len(values) * rank / 100))]
+
+
+class Benchmark:
+    """
+    Plays scenarios against the WSGI application in process and records, per endpoint, the latency,
+    the status codes and the number of queries of every request.
+    """
+
+    def __init__(self, mix, seed=None):
+        self.names, self.weights = zip(*mix.items())
+        self.random = random.Random(seed)
+        self.product_ids = [str(pk) for pk in Product.objects.values_list("pk", flat=True)]
+        self.category_ids = [str(pk) for pk in Category.objects.values_list("pk", flat=True)]
+        self.customers = list(User.objects.filter(is_staff=False))
+        self.samples = defaultdict(list)
+        self.lock = Lock()
+
+    def run(self, iterations, workers):
+        # Drawn up front, so the same seed plays the same traffic whatever the scheduling of the threads
+        plan = [
+            (name, random.Random(self.random.random()))
+            for name in self.random.choices(self.names, self.weights, k=iterations)
+        ]
+        start = time.perf_counter()
+        if workers == 1:
+            for name, rng in plan:
+                self.play(name, rng)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(lambda scenario: self.play_in_thread(*scenario), plan))
+        return time.perf_counter() - start
+
+    def play_in_thread(self, name, rng):
+        try:
+            self.play(name, rng)
+        finally:
+            connection.close()
+
+    def play(self, name, rng):
+        # Server errors are reported as 500s in the statuses instead of stopping the run
+        client = APIClient(raise_request_exception=False)
+        getattr(self, f"scenario_{name}")(client, rng)
+
+    def request(self, client, label, method, url, data=None):
+        queries = QueryCounter()
+        with connections["default"].execute_wrapper(queries):
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data, format="json")
+            if response.streaming:
+                b"".join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples[label].append((elapsed, response.status_code, queries.count))
+        return response
+
+    def scenario_browse(self, client, rng):
+        self.request(client, "GET products-list", "get", reverse("products-list"), {"page": rng.randint(1, 20)})
+        product_id = rng.choice(self.product_ids)
+        self.request(client, "GET products-detail", "get", reverse("products-detail", args=[product_id]))
+        self.request(client, "GET product-reviews-list", "get", reverse("product-reviews-list", args=[product_id]))
+        if rng.random() < 0.3:
+            self.request(client, "GET products-list?category_id", "get", reverse("products-list"), {
+                "category_id": rng.choice(self.category_ids),
+            })
+
+    def scenario_search(self, client, rng):
+        term = f"product {rng.randint(0, len(self.product_ids))}"
+        self.request(client, "GET products-list?search", "get", reverse("products-list"), {"search": term})
+        self.request(client, "GET products-suggest", "get", reverse("products-suggest"), {"q": term[:-1]})
+
+    def fill_cart(self, client, rng):
+        response = self.request(client, "POST cart-list", "post", reverse("cart-list"))
+        if response.status_code != 201:
+            return None
+        cart_id = response.data["id"]
+        for product_id in rng.sample(self.product_ids, rng.randint(1, 3)):
+            self.request(client, "POST cart-items-list", "post", reverse("cart-items-list", args=[cart_id]), {
+                "product": product_id, "quantity": rng.randint(1, 2),
+            })
+        return cart_id
+
+    def scenario_cart(self, client, rng):
+        cart_id = self.fill_cart(client, rng)
+        if cart_id is None:
+            return
+        self.request(client, "GET cart-detail", "get", reverse("cart-detail", args=[cart_id]))
+
+    def scenario_checkout(self, client, rng):
+        cart_id = self.fill_cart(client, rng)
+        if cart_id is None:
+            return
+        client.force_authenticate(rng.choice(self.customers))
+        self.request(client, "POST order-list", "post", reverse("order-list"), {"cart_id": cart_id})
+        self.request(client, "GET order-list", "get", reverse("order-list"))
+
+    def report(self, elapsed):
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            latencies = sorted(latency for latency, _, _ in samples)
+            statuses = defaultdict(int)
+            for _, status_code, _ in samples:
+                statuses[str(status_code)] += 1
+            endpoints[label] = {
+                "requests": len(samples),
+                "throughput": round(len(samples) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                "max_ms": round(latencies[-1] * 1000, 2),
+                "queries_per_request": round(sum(queries for _, _, queries in samples) / len(samples), 2),
+                "max_queries": max(queries for _, _, queries in samples),
+                "statuses": dict(sorted(statuses.items())),
+            }
+        total = sum(endpoint["requests"] for endpoint in endpoints.values())
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "requests": total,
+            "throughput": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API: seed a synthetic catalog in a throwaway test database, play a mix of browse, search, "
+        "add-to-cart and checkout scenarios against the in-process application from a thread pool, and report the "
+        "latency percentiles, throughput and queries per request of every endpoint as JSON. Keep the seed and the "
+        "options identical between two commits to compare their reports. SQLite serializes writers, run it against "
+        "PostgreSQL for figures under concurrency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=500, help="Number of scenarios played")
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent clients, 1 plays every scenario in turn")
+        parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weights of the scenarios (default {DEFAULT_MIX})")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of the traffic")
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--products", type=int, default=2000)
+        parser.add_argument("--reviews-per-product", type=int, default=2)
+        parser.add_argument("--users", type=int, default=50, help="Customers checking out, on top of the seeded ones")
+        parser.add_argument("--carts", type=int, default=300)
+        parser.add_argument("--orders", type=int, default=300)
+        parser.add_argument("--output", help="Write the report to this file instead of stdout")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs (seeded once)")
+
+    @override_settings(CACHES=BENCH_CACHES)
+    def handle(self, *args, **options):
+        mix = parse_mix(options["mix"])
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=options["keepdb"])
+        try:
+            if not Product.objects.exists():
+                self.seed(options)
+            benchmark = Benchmark(mix, seed=options["seed"])
+            elapsed = benchmark.run(options["iterations"], options["workers"])
+            report = {
+                "commit": self.commit(),
+                "date": timezone.now().isoformat(),
+                "python": platform.python_version(),
+                "database": connection.vendor,
+                "cart_storage": settings.CART_STORAGE,
+                "options": {
+                    name: options[name]
+                    for name in ["iterations", "workers", "mix", "seed", "categories", "products",
+                                 "reviews_per_product", "users", "carts", "orders"]
+                },
+                **benchmark.report(elapsed),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+            self.stderr.write(f"{report['requests']} requests in {report['elapsed_s']}s, report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def seed(self, options):
+        seed_catalog(
+            categories=options["categories"],
+            products=options["products"],
+            reviews_per_product=options["reviews_per_product"],
+            carts=options["carts"],
+            orders=options["orders"],
+        )
+        User.objects.bulk_create([
+            User(username=f"bench{index}", email=f"bench{index}@example.com") for index in range(options["users"])
+        ])
+        # Checkouts of the whole run must not run out of stock
+        Product.objects.update(inventory=options["iterations"] * 10)
+
+    def commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
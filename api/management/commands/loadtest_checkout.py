@@ -0,0 +1,77 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from store.models import Cart, CartItem, Product
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure checkout throughput under contention: concurrent checkouts all buying the same flash sale "
+        "product, then check that its stock was never oversold. Runs on a throwaway test database created "
+        "next to the configured one, like bench. Run it against PostgreSQL, SQLite serializes writers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checkouts", type=int, default=200, help="Number of carts checked out")
+        parser.add_argument("--workers", type=int, default=16, help="Concurrent checkouts")
+        parser.add_argument("--stock", type=int, default=100, help="Initial inventory of the hot product")
+        parser.add_argument("--quantity", type=int, default=1, help="Units of the hot product in every cart")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        user = User.objects.create_user(email="loadtest-checkout@example.com", password=None, username="loadtest")
+        product = Product.objects.create(
+            name="Load test flash sale", description="-", inventory=options["stock"], flash_sales=True
+        )
+        carts = Cart.objects.bulk_create([Cart() for _ in range(options["checkouts"])])
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product=product, quantity=options["quantity"]) for cart in carts]
+        )
+
+        def checkout(cart):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                start = time.perf_counter()
+                response = client.post(reverse("order-list"), {"cart_id": cart.id})
+                return response.status_code, time.perf_counter() - start
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            results = list(executor.map(checkout, carts))
+        elapsed = time.perf_counter() - start
+
+        statuses = [status for status, _ in results]
+        latencies = sorted(latency for _, latency in results)
+        sold = statuses.count(201)
+        product.refresh_from_db()
+
+        self.stdout.write(f"{len(results)} checkouts in {elapsed:.2f}s: {len(results) / elapsed:.1f} checkouts/s")
+        p50, p95 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]
+        self.stdout.write(f"p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms")
+        rejected = statuses.count(400)
+        self.stdout.write(f"{sold} sold, {rejected} out of stock, {len(results) - sold - rejected} errors")
+        self.stdout.write(f"Inventory {options['stock']} -> {product.inventory}")
+
+        if product.inventory < 0 or product.inventory != options["stock"] - sold * options["quantity"]:
+            self.stderr.write(self.style.ERROR("Inventory does not match the orders: stock was oversold"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No oversell"))
@@ -0,0 +1,89 @@
+import os
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+from django.http import HttpResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+
+# Prometheus metrics, scraped from /metrics.
+# Under a server with several worker processes, point the PROMETHEUS_MULTIPROC_DIR environment variable to an
+# empty directory (wiped at every deploy) before the workers start: every process then writes its samples there
+# and /metrics aggregates them, whichever worker answers the scrape. With gunicorn, also call
+# prometheus_client.multiprocess.mark_process_dead(worker.pid) from the child_exit hook.
+
+REQUEST_LATENCY = Histogram(
+    "api_request_duration_seconds",
+    "Time taken to answer a request, by route and viewset action",
+    ["route", "action", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "api_request_db_queries",
+    "Database queries run by a request, by route and viewset action",
+    ["route", "action"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, float("inf")),
+)
+RESPONSE_CACHE = Counter(
+    "api_response_cache_requests_total",
+    "Lookups of the catalog response cache (see api/caching.py)",
+    ["result"],
+)
+CHECKOUTS = Counter(
+    "store_checkouts_total",
+    "Checkouts, by outcome",
+    ["result"],
+)
+CART_LINES_ADDED = Counter(
+    "store_cart_lines_added_total",
+    "Products added to carts, one per line added or incremented",
+)
+
+# Requests that match no URL share one label, so scanners cannot blow up the number of series
+UNMATCHED_ROUTE = "unmatched"
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Records the latency and the number of queries of every request under its route name and viewset action."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        route, action = getattr(request, "metrics_labels", (UNMATCHED_ROUTE, request.method.lower()))
+        REQUEST_LATENCY.labels(route, action, f"{response.status_code // 100}xx").observe(duration)
+        REQUEST_QUERIES.labels(route, action).observe(queries.count)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        method = request.method.lower()
+        # Viewsets map the HTTP methods of a route to their actions: list/create, retrieve/update/destroy...
+        action = getattr(view_func, "actions", {}).get(method, method)
+        request.metrics_labels = (request.resolver_match.view_name, action)
+
+
+def metrics_view(request):
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
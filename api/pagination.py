@@ -0,0 +1,43 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    # Served by the (date_created, id) indexes of products and reviews
+    ordering = ("-date_created", "-id")
+
+
+class OrderKeysetPagination(KeysetPagination):
+    # Served by the (creation_date, id) indexes of orders
+    ordering = ("-creation_date", "-id")
+
+
+class OptInKeysetPagination(PageNumberPagination):
+    """
+    Page numbers by default. Clients that send a ``cursor`` parameter (empty for the first page)
+    get keyset pagination instead: no COUNT(*) and no OFFSET, so deep pages cost as much as the first one.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset = self.keyset_pagination_class()
+        page = self.keyset.paginate_queryset(queryset, request, view)
+        self.display_page_controls = self.keyset.display_page_controls
+        return page
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.keyset is not None:
+            return self.keyset.to_html()
+        return super().to_html()
+
+
+class OrderOptInKeysetPagination(OptInKeysetPagination):
+    keyset_pagination_class = OrderKeysetPagination
@@ -15,14 +15,21 @@ class IsAuthenticatedAndIsAdminUserOrReadOnly(BasePermission):
 # - For other methods (POST, PUT, PATCH, DELETE), it checks if the user is authenticated and is an admin user (is_staff attribute is True).
 
 class IsReviewAuthorOrReadOnly(BasePermission):
+
+    def has_permission(self, request, view):
+        # Only authenticated users can write reviews
+        if request.method in SAFE_METHODS:
+            return True
+        return bool(request.user and request.user.is_authenticated)
     
     def has_object_permission(self, request, view, obj):
         # Allow GET, HEAD, OPTIONS requests for all users
         if request.method in SAFE_METHODS:
             return True
-        # Check if the user is the author of the review
-        return request.user == obj.author
+        # Check if the user is the author of the review, anonymous users have no pk to match reviews without author
+        return request.user.is_authenticated and obj.author_id == request.user.pk
     
 # In this custom permission class:
+# - The has_permission method lets anyone read, and only authenticated users create reviews.
 # - The has_object_permission method checks if the request method is a safe method (GET, HEAD, OPTIONS) and allows it without any further checks.
 # - For other methods (PUT, PATCH, DELETE), it checks if the user making the request is the author of the review being accessed.
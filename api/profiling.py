@@ -0,0 +1,171 @@
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from rest_framework import serializers
+
+
+# Opt-in profiling of a sample of the requests, configured by the API_PROFILING setting:
+# - SAMPLE_RATE: share of the requests profiled, 0 (the default) removes the middleware altogether
+# - SLOW_QUERIES: how many of the slowest statements are logged
+# - N_PLUS_ONE_THRESHOLD: the same SQL run this many times in a request is reported as an N+1 suspect
+
+DEFAULTS = {
+    "SAMPLE_RATE": 0.0,
+    "SLOW_QUERIES": 3,
+    "N_PLUS_ONE_THRESHOLD": 5,
+}
+
+logger = logging.getLogger("api.profiling")
+
+_current_profile = ContextVar("api_profile", default=None)
+
+
+def get_options():
+    return {**DEFAULTS, **getattr(settings, "API_PROFILING", {})}
+
+
+def query_origin():
+    """The innermost frame of the project's own code that led to a query, as "path:line in function"."""
+    root = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and "site-packages" not in filename and filename != __file__:
+            return f"{filename[len(root) + 1:]}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+class RequestProfile:
+    """Collects the queries and the serializer time of one request. Used as a database execute wrapper."""
+
+    def __init__(self):
+        self.queries = []
+        self.serializer_time = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start, query_origin()))
+
+    @property
+    def db_time(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+    def slowest_queries(self, count):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:count]
+
+    def n_plus_one_suspects(self, threshold):
+        # Statements are compared without their parameters, a loop fetching one row at a time repeats the same SQL
+        repeated = Counter(sql for sql, _, _ in self.queries)
+        origins = {}
+        for sql, _, origin in self.queries:
+            origins.setdefault(sql, origin)
+        return [
+            {"sql": sql, "count": count, "origin": origins[sql]}
+            for sql, count in repeated.most_common()
+            if count >= threshold
+        ]
+
+
+def _timed_to_representation(to_representation):
+    @wraps(to_representation)
+    def wrapper(self, instance):
+        profile = _current_profile.get()
+        # Nested serializers run inside their parent's timing
+        if profile is None or profile.serializing:
+            return to_representation(self, instance)
+        profile.serializing = True
+        start = time.perf_counter()
+        try:
+            return to_representation(self, instance)
+        finally:
+            profile.serializer_time += time.perf_counter() - start
+            profile.serializing = False
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument_serializers():
+    """Time to_representation() of every serializer. Idempotent, and a no-op outside profiled requests."""
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(serializer_class.to_representation, "profiled", False):
+            serializer_class.to_representation = _timed_to_representation(serializer_class.to_representation)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of the requests: number of queries and database time, the slowest statements with the
+    line of code that ran them, the time spent serializing and the statements repeated often enough to be N+1
+    suspects. The figures are sent in a Server-Timing header and logged as one JSON line on "api.profiling".
+
+    Streamed responses are measured up to the moment their first byte is ready.
+    """
+
+    def __init__(self, get_response):
+        self.options = get_options()
+        if not self.options["SAMPLE_RATE"]:
+            raise MiddlewareNotUsed
+        instrument_serializers()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= self.options["SAMPLE_RATE"]:
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total = time.perf_counter() - start
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={_ms(profile.db_time)};desc="{len(profile.queries)} queries"',
+            f"serialize;dur={_ms(profile.serializer_time)}",
+            f"total;dur={_ms(total)}",
+        ])
+        self.log(request, response, profile, total)
+        return response
+
+    def log(self, request, response, profile, total):
+        suspects = profile.n_plus_one_suspects(self.options["N_PLUS_ONE_THRESHOLD"])
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": _ms(total),
+            "db_ms": _ms(profile.db_time),
+            "serialize_ms": _ms(profile.serializer_time),
+            "queries": len(profile.queries),
+            "slowest": [
+                {"sql": sql, "ms": _ms(duration), "origin": origin}
+                for sql, duration, origin in profile.slowest_queries(self.options["SLOW_QUERIES"])
+            ],
+            "n_plus_one": suspects,
+        }
+        logger.log(logging.WARNING if suspects else logging.INFO, json.dumps(record, cls=DjangoJSONEncoder))
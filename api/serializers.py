@@ -1,7 +1,12 @@
 from rest_framework import serializers
-from store.models import Category, Product, Review, Cart, CartItem, Order, OrderItem
+from rest_framework.exceptions import NotFound
+from store.cart_storage import get_cart_storage
+from store.models import Category, Product, Review, Cart, CartItem, Order, OrderItem, OutOfStock
 from django.db import transaction
 
+from .caching import invalidate_products
+from .metrics import CART_LINES_ADDED, CHECKOUTS
+
 
 
 ############################################### All Serializers related to Category ###############################################
@@ -24,14 +29,13 @@ class AddProductSerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     category = CategorySerializer()
-    review_count = serializers.SerializerMethodField(method_name="count")
+    price = serializers.FloatField(read_only=True)
+    # Annotated by ProductModelViewset.queryset
+    review_count = serializers.IntegerField(read_only=True)
     class Meta:
         model = Product
         fields = ["id", "name", "description", "old_price", "discount", "price", "category", "inventory", "review_count"]
 
-    def count(self, product: Product):
-        return product.reviews.all().count()
-
 
 
 ############################################### All Serializers related Reviews ###############################################
@@ -52,13 +56,14 @@ class ReviewSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         product_id = self.context["product_id"]
         user = self.context["user"]
-        return Review.objects.create(product_id=product_id, author=user, **validated_data)
+        return Review.objects.create(product_id=product_id, author_id=user.pk, **validated_data)
 
 
 
 ############################################### All Serializers related CartItems ###############################################
     
 class SimpleProductSerializer(serializers.ModelSerializer):
+    price = serializers.FloatField(read_only=True)
     class Meta:
         model = Product
         fields = ["name", "discount", "price"]
@@ -76,35 +81,67 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 
 class AddCartItemSerializer(serializers.ModelSerializer):
-    quantity = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
     class Meta:
         model = CartItem
         fields = ["id", "product", "quantity"]
 
 
     def save(self, **kwargs):
-        # print(self.validated_data)
         cart_id = self.context["cart_id"]
-        product_id = self.validated_data["product"]
+        product = self.validated_data["product"]
         quantity = self.validated_data["quantity"]
 
         try:
-            cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-            cart_item.quantity += quantity
-            cart_item.save()
+            self.instance = get_cart_storage().add_item(cart_id, product.pk, quantity)
+        except Cart.DoesNotExist:
+            raise NotFound("No cart was found with this id.")
+        CART_LINES_ADDED.inc()
+        return self.instance
 
-            self.instance = cart_item
+class BulkAddCartItemSerializer(serializers.ListSerializer):
+    # Products are checked all at once instead of one query per line, errors are reported per line
+    def to_internal_value(self, data):
+        attrs = super().to_internal_value(data)
+        product_ids = {line["product_id"] for line in attrs}
+        found = set(Product.objects.filter(pk__in=product_ids).values_list("pk", flat=True))
+        errors = [
+            {} if line["product_id"] in found else {"product": [f'Invalid pk "{line["product_id"]}" - object does not exist.']}
+            for line in attrs
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return attrs
 
-        except:
-            self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
-        
+    def save(self, **kwargs):
+        quantities = {}
+        for line in self.validated_data:
+            quantities[line["product_id"]] = quantities.get(line["product_id"], 0) + line["quantity"]
+        try:
+            self.instance = get_cart_storage().add_items(self.context["cart_id"], quantities)
+        except Cart.DoesNotExist:
+            raise NotFound("No cart was found with this id.")
+        CART_LINES_ADDED.inc(len(quantities))
         return self.instance
 
+
+class CartLineSerializer(serializers.Serializer):
+    id = serializers.IntegerField(read_only=True)
+    product = serializers.UUIDField(source="product_id")
+    quantity = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        list_serializer_class = BulkAddCartItemSerializer
+
+
 class UpdateCartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ["quantity"]
 
+    def update(self, instance, validated_data):
+        return get_cart_storage().update_item(instance, validated_data.get("quantity", instance.quantity))
+
 
 ############################################### All Serializers related Cart ###############################################
 
@@ -116,13 +153,14 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ["id", "cart_items", "item_count", "grand_total"]
     
+    # Both read the lines the cart storage loaded with their products, no extra queries
     def total(self, cart: Cart):
         items = cart.cart_items.all()
         total = sum([item.quantity * item.product.price for item in items ])
         return total
     
     def count(self, cart: Cart):
-        return cart.cart_items.all().count()
+        return len(cart.cart_items.all())
 
 
 ############################################### All Serializers related Order items ###############################################
@@ -130,7 +168,8 @@ class CartSerializer(serializers.ModelSerializer):
 class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
-        fields = ["id", "product", "quantity"]
+        fields = ["id", "product", "quantity", "unit_price"]
+        read_only_fields = ["unit_price"]
 
 
 
@@ -138,32 +177,52 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
 class OrderSerializer(serializers.ModelSerializer):
     order_items = OrderItemSerializer(many=True, read_only=True)
-    grand_total = serializers.SerializerMethodField(method_name="total")
+    grand_total = serializers.FloatField(source="total_amount", read_only=True)
     item_count = serializers.SerializerMethodField(method_name="count")
     class Meta:
         model = Order
         fields = ["id", "order_items", "item_count", "grand_total", "order_status", "creation_date"]
-    
-    def total(self, order: Order):
-        items = order.order_items.all()
-        total = sum([item.quantity * item.product.price for item in items ])
-        return total
-    
+
+    # Reads the items OrderModelViewset prefetched
     def count(self, order: Order):
-        return order.order_items.all().count()
+        return len(order.order_items.all())
 
 
 class CreateOrderSerializer(serializers.Serializer):
     cart_id = serializers.UUIDField(default="")
 
     def save(self, **kwargs):
-        with transaction.atomic():
-            cart_id = self.validated_data["cart_id"]
+        cart_id = self.validated_data["cart_id"]
+        cart_storage = get_cart_storage()
+        # The cart is held until the order is committed: a concurrent checkout of the same cart finds it gone,
+        # and lines added meanwhile wait instead of being deleted unseen
+        with cart_storage.lock(cart_id), transaction.atomic():
             user_id = self.context["user_id"]
-            order = Order.objects.create(owner_id=user_id)
 
-            cart_items = CartItem.objects.filter(cart_id=cart_id)
-            order_items = [OrderItem(order_id=order.id, product=item.product, quantity=item.quantity ) for item in cart_items]
-            OrderItem.objects.bulk_create(order_items)
-            Cart.objects.get(id=cart_id).delete()
+            lines = cart_storage.checkout_lines(cart_id)
+            if not lines:
+                CHECKOUTS.labels("empty_cart").inc()
+                raise serializers.ValidationError({"cart_id": ["No cart with items was found with this id."]})
+
+            quantities = {product_id: quantity for product_id, quantity, _ in lines}
+            try:
+                Product.objects.reserve(quantities)
+            except OutOfStock as error:
+                CHECKOUTS.labels("out_of_stock").inc()
+                raise serializers.ValidationError({"cart_id": [str(error)]})
+            # reserve() is a bulk update, it does not send the signals that invalidate cached products
+            invalidate_products(*quantities)
+
+            total_amount = sum(quantity * price for _, quantity, price in lines)
+            order = Order.objects.create(owner_id=user_id, total_amount=total_amount)
+            OrderItem.objects.bulk_create([
+                OrderItem(order_id=order.id, product_id=product_id, quantity=quantity, unit_price=price)
+                for product_id, quantity, price in lines
+            ])
+
+            if not cart_storage.delete(cart_id):
+                # Checked out by a concurrent request since its lines were read, roll this order back
+                CHECKOUTS.labels("empty_cart").inc()
+                raise serializers.ValidationError({"cart_id": ["No cart with items was found with this id."]})
+            transaction.on_commit(CHECKOUTS.labels("completed").inc)
             return order
\ No newline at end of file
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from store.models import Category, Product, Review
+from store.signals import products_bulk_saved
+from .caching import invalidate_categories, invalidate_products
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_responses(sender, instance, **kwargs):
+    invalidate_categories(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_responses(sender, instance, **kwargs):
+    invalidate_products(instance.pk)
+
+
+@receiver(products_bulk_saved, sender=Product)
+def invalidate_bulk_saved_product_responses(sender, products, **kwargs):
+    invalidate_products(*[product.pk for product in products])
+
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_reviewed_product_responses(sender, instance, **kwargs):
+    # review_count is part of the product representation
+    invalidate_products(instance.product_id)
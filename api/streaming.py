@@ -0,0 +1,28 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+def stream_json_array(rows, batch_size=500):
+    """Encode an iterable of dicts as a JSON array, ``batch_size`` rows per chunk, without holding it in memory."""
+    encode = DjangoJSONEncoder().encode
+    yield "["
+    batch = []
+    separator = ""
+    for row in rows:
+        batch.append(encode(row))
+        if len(batch) == batch_size:
+            yield separator + ",".join(batch)
+            batch, separator = [], ","
+    if batch:
+        yield separator + ",".join(batch)
+    yield "]"
+
+
+def json_stream_response(rows, filename):
+    """
+    A response that sends ``rows`` as they are read. Pass dicts from ``.values().iterator(chunk_size=...)``
+    so the database cursor, not a list of model instances, feeds the encoder.
+    """
+    response = StreamingHttpResponse(stream_json_array(rows), content_type="application/json")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,106 @@
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.template.defaultfilters import slugify
+from django.test.utils import CaptureQueriesContext
+from rest_framework import test
+
+from store.models import Category, Product, Review, Cart, CartItem, Order, OrderItem
+from store.search import rebuild_search_index
+
+
+User = get_user_model()
+
+
+############################################### Catalog seeding ###############################################
+
+def seed_catalog(categories=20, products=2000, reviews_per_product=2, carts=300, orders=300, lines=3):
+    """
+    Bulk insert a realistic catalog: categories, products with reviews, carts and orders with items.
+    Returns a dict with the created users so callers can authenticate as them.
+    """
+    customer = User.objects.create_user(email="customer@example.com", password="password", username="customer")
+    staff = User.objects.create_user(email="staff@example.com", password="password", username="staff", is_staff=True)
+
+    category_objs = Category.objects.bulk_create(
+        [Category(title=f"Category {index}", slug=slugify(f"Category {index}")) for index in range(categories)]
+    )
+
+    product_objs = Product.objects.bulk_create([
+        Product(
+            name=f"Product {index}",
+            slug=slugify(f"Product {index}"),
+            description=f"Description of product {index}",
+            old_price=10 + index % 500,
+            discount=index % 3 == 0,
+            category=category_objs[index % categories],
+            inventory=100,
+        )
+        for index in range(products)
+    ])
+
+    Review.objects.bulk_create([
+        Review(product=product, author=customer, content="Review")
+        for product in product_objs
+        for _ in range(reviews_per_product)
+    ])
+
+    cart_objs = Cart.objects.bulk_create([Cart() for _ in range(carts)])
+    CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=product_objs[(index * lines + line) % products], quantity=line + 1)
+        for index, cart in enumerate(cart_objs)
+        for line in range(lines)
+    ])
+
+    order_objs = Order.objects.bulk_create([
+        Order(owner=customer if index % 2 else staff) for index in range(orders)
+    ])
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product_objs[(index * lines + line) % products], quantity=line + 1)
+        for index, order in enumerate(order_objs)
+        for line in range(lines)
+    ])
+
+    # Orders are bulk created without prices, record them as a checkout would
+    OrderItem.objects.snapshot_prices()
+    Order.objects.update_totals()
+
+    # bulk_create skips the signals that keep the SQLite search index in sync
+    rebuild_search_index()
+
+    return {"customer": customer, "staff": staff}
+
+
+############################################### Test cases ###############################################
+
+class APITestCase(test.APITestCase):
+    """Starts every test with an empty cache so cached responses never leak from one test to another."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Base class for tests that pin the number of SQL queries and the latency of an endpoint.
+    A budget that holds against a seeded catalog fails as soon as a serializer starts querying per row.
+    """
+    max_latency = 1.0
+
+    @contextmanager
+    def assertQueryBudget(self, max_queries, max_latency=None):
+        max_latency = self.max_latency if max_latency is None else max_latency
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        elapsed = time.perf_counter() - start
+
+        executed = len(context.captured_queries)
+        if executed > max_queries:
+            queries = "\n".join(query["sql"] for query in context.captured_queries)
+            self.fail(f"{executed} queries executed, budget is {max_queries}:\n{queries}")
+        self.assertLessEqual(elapsed, max_latency, f"Took {elapsed:.3f}s, budget is {max_latency:.3f}s")
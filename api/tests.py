@@ -1,3 +1,932 @@
-from django.test import TestCase
+import json
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from store.cart_storage import CacheCartStorage, DatabaseCartStorage
+from store.models import Category, Product, Review, Cart, CartItem, Order, OrderItem
+from . import urls
+from .management.commands.bench import Benchmark, parse_mix
+from .profiling import RequestProfile
+from .testing import APITestCase, QueryBudgetTestCase, seed_catalog
+
+User = get_user_model()
 
 # Create your tests here.
+
+
+class ProductListQueryTestCase(APITestCase):
+    """
+    The product list must cost the same number of queries whatever the page size: one COUNT(*) for the
+    paginator and one SELECT joining categories and counting reviews, whose rows also make the ETag.
+    """
+
+    def create_products(self, count):
+        category = Category.objects.create(title="Phones")
+        for index in range(count):
+            product = Product.objects.create(
+                name=f"Product {index}", description="A product", old_price=100, category=category, inventory=5
+            )
+            Review.objects.create(product=product, content="Nice")
+            Review.objects.create(product=product, content="Great")
+
+    def test_product_list_query_count_does_not_grow_with_page_size(self):
+        url = reverse("products-list")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_products(2)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data["results"]), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_products(8)
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertTrue(all(product["review_count"] == 2 for product in response.data["results"]))
+
+
+class ProductPriceTestCase(APITestCase):
+    """price is a generated column, so filtering and ordering on it happen in SQL."""
+
+    def setUp(self):
+        self.discounted = Product.objects.create(name="Discounted", description="-", old_price=100, discount=True, inventory=1)
+        self.regular = Product.objects.create(name="Regular", description="-", old_price=80, inventory=1)
+
+    def test_price_is_filterable_and_orderable(self):
+        response = self.client.get(reverse("products-list"), {"price__lt": 75})
+        self.assertEqual([product["name"] for product in response.data["results"]], ["Discounted"])
+
+        response = self.client.get(reverse("products-list"), {"ordering": "price"})
+        self.assertEqual([product["name"] for product in response.data["results"]], ["Discounted", "Regular"])
+
+    def test_price_follows_bulk_updates(self):
+        Product.objects.filter(pk=self.discounted.pk).update(discount=False)
+        self.assertEqual(Product.objects.get(pk=self.discounted.pk).price, 100)
+
+
+class ProductSearchTestCase(APITestCase):
+    """?search= goes through the full-text index and ranks name matches above description matches."""
+
+    def setUp(self):
+        Product.objects.create(name="Leather wallet", description="Holds phone cards", inventory=1)
+        Product.objects.create(name="Phone case", description="Protects the phone", inventory=1)
+        Product.objects.create(name="Desk lamp", description="Bright", inventory=1)
+
+    def test_search_is_ranked(self):
+        response = self.client.get(reverse("products-list"), {"search": "phone"})
+        self.assertEqual([product["name"] for product in response.data["results"]], ["Phone case", "Leather wallet"])
+
+    def test_search_follows_updates_and_deletes(self):
+        Product.objects.get(name="Desk lamp").delete()
+        wallet = Product.objects.get(name="Leather wallet")
+        wallet.name = "Leather lamp"
+        wallet.save()
+
+        response = self.client.get(reverse("products-list"), {"search": "lamp"})
+        self.assertEqual([product["name"] for product in response.data["results"]], ["Leather lamp"])
+
+    def test_search_without_words(self):
+        for terms in ['"', " -"]:
+            response = self.client.get(reverse("products-list"), {"search": terms})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data["results"], [])
+
+    def test_suggest_tolerates_typos(self):
+        response = self.client.get(reverse("products-suggest"), {"q": "walet"})
+        self.assertEqual(response.data, [{"name": "Leather wallet", "slug": "leather-wallet"}])
+
+        response = self.client.get(reverse("products-suggest"), {"q": "Ph"})
+        self.assertEqual(response.data[0]["name"], "Phone case")
+
+
+class CatalogResponseCacheTestCase(APITestCase):
+    """Catalog GETs are served from the cache until a write bumps the versions they depend on."""
+
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(title="Phones")
+        self.product = Product.objects.create(name="Phone", description="-", category=self.category, inventory=1)
+        self.other = Product.objects.create(name="Case", description="-", inventory=1)
+
+    def get(self, url, queries):
+        with self.assertNumQueries(queries):
+            return self.client.get(url)
+
+    def test_list_and_detail_are_cached(self):
+        self.get(reverse("products-list"), 2)
+        self.get(reverse("products-list"), 0)
+        self.get(reverse("products-list") + "?ordering=price", 2)
+        self.get(reverse("products-detail", args=[self.product.id]), 2)
+        self.get(reverse("products-detail", args=[self.product.id]), 0)
+
+    def test_writes_invalidate_precisely(self):
+        self.get(reverse("products-detail", args=[self.product.id]), 2)
+        self.get(reverse("products-detail", args=[self.other.id]), 2)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Review.objects.create(product=self.product, content="Nice")
+            # Until the write commits, other requests cannot see it and keep the cached response
+            self.get(reverse("products-detail", args=[self.product.id]), 0)
+        for callback in callbacks:
+            callback()
+        response = self.get(reverse("products-detail", args=[self.product.id]), 2)
+        self.assertEqual(response.data["review_count"], 1)
+        self.get(reverse("products-detail", args=[self.other.id]), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.title = "Smartphones"
+            self.category.save()
+        response = self.get(reverse("products-detail", args=[self.product.id]), 2)
+        self.assertEqual(response.data["category"]["title"], "Smartphones")
+        self.get(reverse("categories-list"), 2)
+
+
+class ConditionalGetTestCase(APITestCase):
+    """Clients sending back the validators of an unchanged resource get a 304 without a serializer run."""
+
+    def setUp(self):
+        super().setUp()
+        self.product = Product.objects.create(name="Phone", description="-", old_price=10, inventory=1)
+        self.cart = Cart.objects.create()
+
+    def test_unchanged_product_is_not_modified(self):
+        url = reverse("products-detail", args=[self.product.id])
+        etag = self.client.get(url)["ETag"]
+
+        # Answered from the cached validators
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Review.objects.create(product=self.product, content="Nice")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_list_changes_with_its_page(self):
+        url = reverse("products-list")
+        etag = self.client.get(url)["ETag"]
+
+        # The COUNT(*) and the page, nothing aggregated over the whole table
+        cache.clear()
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Product.objects.create(name="Case", description="-", old_price=5, inventory=1)
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 2)
+
+    def test_cart_changes_with_its_lines_and_products(self):
+        url = reverse("cart-detail", args=[self.cart.id])
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post(reverse("cart-items-list", args=[self.cart.id]), {"product": self.product.id, "quantity": 1})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        self.product.old_price = 20
+        self.product.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ConcurrentAddToCartTestCase(TransactionTestCase):
+    """Parallel add-to-cart clicks on the same product end up as one line holding every increment."""
+
+    def setUp(self):
+        self.cart = Cart.objects.create()
+        self.product = Product.objects.create(name="Phone", description="-", inventory=1)
+
+    def add_to_cart(self, _):
+        try:
+            # Each thread gets its own connection and its own client
+            return APIClient().post(
+                reverse("cart-items-list", args=[self.cart.id]), {"product": self.product.id, "quantity": 2}
+            ).status_code
+        finally:
+            connection.close()
+
+    def test_adding_twice_increments_the_line(self):
+        self.add_to_cart(0)
+        self.add_to_cart(1)
+        line = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(line.quantity, 4)
+
+    # SQLite serializes writers, and its shared in-memory test database fails them with "table is locked"
+    @skipIf(connection.vendor == "sqlite", "needs a database with concurrent writers")
+    def test_parallel_adds_do_not_lose_increments(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(self.add_to_cart, range(40)))
+
+        self.assertEqual(statuses, [201] * 40)
+        line = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(line.quantity, 80)
+
+
+class CheckoutStockTestCase(APITestCase):
+    """Checkout takes stock for every line at once and refuses carts that would oversell."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+        self.client.force_authenticate(self.user)
+        self.hot = Product.objects.create(name="Hot", description="-", old_price=10, inventory=3, flash_sales=True)
+        self.other = Product.objects.create(name="Other", description="-", inventory=10)
+
+    def checkout(self, *lines):
+        cart = Cart.objects.create()
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        return cart, self.client.post(reverse("order-list"), {"cart_id": cart.id})
+
+    def test_checkout_decrements_stock(self):
+        _, response = self.checkout((self.hot, 2), (self.other, 1))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.get(pk=self.hot.pk).inventory, 1)
+        self.assertEqual(Product.objects.get(pk=self.other.pk).inventory, 9)
+
+    def test_cart_checked_out_concurrently_rolls_back(self):
+        # The other checkout deleted the cart between our read of its lines and our delete
+        with mock.patch.object(DatabaseCartStorage, "delete", return_value=False):
+            _, response = self.checkout((self.hot, 2))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.hot.pk).inventory, 3)
+
+    def test_checkout_snapshots_prices_and_deletes_cart(self):
+        cart, _ = self.checkout((self.hot, 2))
+        Product.objects.filter(pk=self.hot.pk).update(old_price=99)
+
+        item = OrderItem.objects.get(product=self.hot)
+        self.assertEqual(item.unit_price, self.hot.price)
+        self.assertEqual(item.order.total_amount, 2 * self.hot.price)
+        self.assertFalse(Cart.objects.filter(pk=cart.pk).exists())
+        self.assertFalse(CartItem.objects.filter(cart_id=cart.pk).exists())
+
+    def test_checkout_of_empty_cart_is_rejected(self):
+        _, response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_checkout_without_enough_stock_rolls_back(self):
+        self.checkout((self.hot, 2))
+        cart, response = self.checkout((self.other, 1), (self.hot, 2))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.hot.pk), response.data["cart_id"][0])
+        self.assertEqual(Product.objects.get(pk=self.hot.pk).inventory, 1)
+        self.assertEqual(Product.objects.get(pk=self.other.pk).inventory, 10)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+
+
+class OrderTotalTestCase(APITestCase):
+    """Orders store their total, checkout sets it and editing the items keeps it up to date."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name="Product", description="-", old_price=10, inventory=10)
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        self.client.post(reverse("order-list"), {"cart_id": cart.id})
+        self.order = Order.objects.get()
+        self.item = self.order.order_items.get()
+
+    def test_price_changes_do_not_alter_orders(self):
+        Product.objects.filter(pk=self.product.pk).update(old_price=50)
+        response = self.client.get(reverse("order-detail", args=[self.order.id]))
+        self.assertEqual(response.data["grand_total"], 20)
+        self.assertEqual(response.data["order_items"][0]["unit_price"], 10)
+
+    def test_item_changes_update_the_total(self):
+        url = reverse("order-items-detail", args=[self.order.id, self.item.id])
+        self.client.patch(url, {"quantity": 3})
+        self.assertEqual(Order.objects.get().total_amount, 30)
+        self.client.delete(url)
+        self.assertEqual(Order.objects.get().total_amount, 0)
+
+    def test_added_item_belongs_to_the_order_in_the_url(self):
+        response = self.client.post(reverse("order-items-list", args=[self.order.id]), {"product": self.product.id, "quantity": 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.order.order_items.count(), 2)
+        self.assertEqual(Order.objects.get().total_amount, 30)
+
+    def test_items_of_other_orders_are_hidden(self):
+        other = User.objects.create_user(email="other@example.com", password="password", username="other")
+        other_order = Order.objects.create(owner=other)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(reverse("order-items-list", args=[self.order.id])).data["count"], 0)
+        self.assertEqual(self.client.get(reverse("order-items-detail", args=[self.order.id, self.item.id])).status_code, 404)
+        # Not through an order of their own either
+        self.assertEqual(self.client.get(reverse("order-items-detail", args=[other_order.id, self.item.id])).status_code, 404)
+        response = self.client.post(reverse("order-items-list", args=[self.order.id]), {"product": self.product.id, "quantity": 1})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.order.order_items.count(), 1)
+
+        staff = User.objects.create_user(email="staff@example.com", password="password", username="staff", is_staff=True)
+        self.client.force_authenticate(staff)
+        self.assertEqual(self.client.get(reverse("order-items-list", args=[self.order.id])).data["count"], 1)
+
+    def test_malformed_order_id(self):
+        self.assertEqual(self.client.get(reverse("order-items-list", args=["not-a-uuid"])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("order-items-detail", args=["not-a-uuid", self.item.id])).status_code, 404)
+        response = self.client.post(reverse("order-items-list", args=["None"]), {"product": self.product.id, "quantity": 1})
+        self.assertEqual(response.status_code, 404)
+
+
+class IdempotencyKeyTestCase(APITestCase):
+    """Retried POSTs that carry the same Idempotency-Key replay the first response instead of running again."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+        self.product = Product.objects.create(name="Product", description="-", old_price=10, inventory=10)
+        self.cart = Cart.objects.create()
+
+    def test_retried_add_to_cart_is_not_counted_twice(self):
+        url = reverse("cart-items-list", args=[self.cart.id])
+        data = {"product": self.product.id, "quantity": 2}
+        first = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY="add-1")
+        retry = self.client.post(url, data, HTTP_IDEMPOTENCY_KEY="add-1")
+
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 2)
+
+        self.client.post(url, data, HTTP_IDEMPOTENCY_KEY="add-2")
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 4)
+
+    def test_retried_checkout_is_replayed_without_queries(self):
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        self.client.force_authenticate(self.user)
+        self.client.post(reverse("order-list"), {"cart_id": self.cart.id}, HTTP_IDEMPOTENCY_KEY="checkout")
+
+        with self.assertNumQueries(0):
+            retry = self.client.post(reverse("order-list"), {"cart_id": self.cart.id}, HTTP_IDEMPOTENCY_KEY="checkout")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        url = reverse("cart-items-list", args=[self.cart.id])
+        self.client.post(url, {"product": self.product.id, "quantity": 1}, HTTP_IDEMPOTENCY_KEY="add")
+        response = self.client.post(url, {"product": self.product.id, "quantity": 5}, HTTP_IDEMPOTENCY_KEY="add")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 1)
+
+    def test_rejected_request_can_be_retried(self):
+        self.client.force_authenticate(self.user)
+        first = self.client.post(reverse("order-list"), {"cart_id": self.cart.id}, HTTP_IDEMPOTENCY_KEY="checkout")
+        self.assertEqual(first.status_code, 400)
+
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        retry = self.client.post(reverse("order-list"), {"cart_id": self.cart.id}, HTTP_IDEMPOTENCY_KEY="checkout")
+        self.assertEqual(retry.status_code, 201)
+
+
+class BulkAddToCartTestCase(APITestCase):
+    """Many lines added by one request, all or nothing."""
+
+    def setUp(self):
+        super().setUp()
+        self.products = [
+            Product.objects.create(name=f"Product {index}", description="-", old_price=10, inventory=10)
+            for index in range(3)
+        ]
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        self.url = reverse("cart-items-bulk", args=[self.cart.id])
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list("product_id", "quantity"))
+
+    def test_lines_are_added_and_merged(self):
+        lines = [
+            {"product": str(self.products[0].id), "quantity": 2},
+            {"product": str(self.products[1].id), "quantity": 1},
+            {"product": str(self.products[1].id), "quantity": 3},
+        ]
+        response = self.client.post(self.url, lines, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.quantities(), {self.products[0].id: 3, self.products[1].id: 4})
+        self.assertEqual([line["quantity"] for line in response.data], [3, 4])
+
+    def test_unknown_cart(self):
+        unknown = "00000000-0000-0000-0000-000000000000"
+        line = {"product": str(self.products[1].id), "quantity": 1}
+        response = self.client.post(reverse("cart-items-bulk", args=[unknown]), [line], format="json")
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse("cart-items-list", args=[unknown]), line)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(CartItem.objects.exclude(cart=self.cart).exists())
+
+    def test_unknown_product_rejects_every_line(self):
+        lines = [
+            {"product": str(self.products[1].id), "quantity": 1},
+            {"product": "00000000-0000-0000-0000-000000000000", "quantity": 1},
+        ]
+        response = self.client.post(self.url, lines, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertIn("product", response.data[1])
+        self.assertEqual(self.quantities(), {self.products[0].id: 1})
+
+    @override_settings(CART_STORAGE="store.cart_storage.CacheCartStorage")
+    def test_cached_cart(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        lines = [{"product": str(product.id), "quantity": 2} for product in self.products]
+        self.client.post(reverse("cart-items-bulk", args=[cart_id]), lines, format="json")
+
+        cart = self.client.get(reverse("cart-detail", args=[cart_id])).data
+        self.assertEqual(cart["item_count"], 3)
+        self.assertEqual(cart["grand_total"], 60)
+
+
+@override_settings(CART_STORAGE="store.cart_storage.CacheCartStorage")
+class CacheCartStorageTestCase(APITestCase):
+    """Carts kept in the cache answer like database carts and never write the cart tables until flushed."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+        self.product = Product.objects.create(name="Product", description="-", old_price=10, inventory=10)
+        self.other = Product.objects.create(name="Other", description="-", old_price=5, inventory=10)
+
+    def test_cart_lifecycle_does_not_touch_cart_tables(self):
+        with CaptureQueriesContext(connection) as context:
+            cart_id = self.client.post(reverse("cart-list")).data["id"]
+            items_url = reverse("cart-items-list", args=[cart_id])
+            self.client.post(items_url, {"product": self.product.id, "quantity": 1})
+            item_id = self.client.post(items_url, {"product": self.product.id, "quantity": 2}).data["id"]
+            other_id = self.client.post(items_url, {"product": self.other.id, "quantity": 1}).data["id"]
+            self.client.patch(reverse("cart-items-detail", args=[cart_id, item_id]), {"quantity": 4})
+            self.client.delete(reverse("cart-items-detail", args=[cart_id, other_id]))
+            cart = self.client.get(reverse("cart-detail", args=[cart_id])).data
+
+        # Only the item id counter is read, to start it after the ids of the flushed carts
+        cart_queries = [query["sql"] for query in context.captured_queries if "store_cart" in query["sql"]]
+        self.assertEqual(len(cart_queries), 1)
+        self.assertTrue(cart_queries[0].startswith("SELECT MAX"))
+        self.assertEqual(cart["item_count"], 1)
+        self.assertEqual(cart["cart_items"][0]["id"], item_id)
+        self.assertEqual(cart["cart_items"][0]["quantity"], 4)
+        self.assertEqual(cart["grand_total"], 40)
+        self.assertEqual(self.client.get(items_url).data["count"], 1)
+
+    def test_checkout_reads_the_cached_cart(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.client.post(reverse("cart-items-list", args=[cart_id]), {"product": self.product.id, "quantity": 3})
+
+        self.client.force_authenticate(self.user)
+        response = self.client.post(reverse("order-list"), {"cart_id": cart_id})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.get().total_amount, 30)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).inventory, 7)
+        self.assertEqual(self.client.get(reverse("cart-detail", args=[cart_id])).status_code, 404)
+
+    def test_checkout_holds_the_cart(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.client.post(reverse("cart-items-list", args=[cart_id]), {"product": self.product.id, "quantity": 3})
+        held = []
+
+        self.client.force_authenticate(self.user)
+        with mock.patch("api.serializers.invalidate_products", lambda *pks: held.append(cache.get(f"cart:{cart_id}:lock"))):
+            response = self.client.post(reverse("order-list"), {"cart_id": cart_id})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(held[0])
+        self.assertIsNone(cache.get(f"cart:{cart_id}:lock"))
+
+    def test_flushed_cart_survives_the_loss_of_the_cache(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.client.post(reverse("cart-items-list", args=[cart_id]), {"product": self.product.id, "quantity": 2})
+
+        call_command("flush_carts", stdout=StringIO())
+        self.assertEqual(CartItem.objects.get(cart_id=cart_id).quantity, 2)
+        self.assertIsNone(cache.get("cart:journal:1"))
+
+        cache.clear()
+        cart = self.client.get(reverse("cart-detail", args=[cart_id])).data
+        self.assertEqual(cart["cart_items"][0]["quantity"], 2)
+
+    def test_flushed_items_keep_their_ids(self):
+        carts = [self.client.post(reverse("cart-list")).data["id"] for _ in range(2)]
+        item_ids = [
+            self.client.post(reverse("cart-items-list", args=[cart_id]), {"product": self.product.id, "quantity": 1}).data["id"]
+            for cart_id in carts
+        ]
+        self.assertNotEqual(item_ids[0], item_ids[1])
+
+        call_command("flush_carts", stdout=StringIO())
+        cache.clear()
+        for cart_id, item_id in zip(carts, item_ids):
+            response = self.client.get(reverse("cart-items-detail", args=[cart_id, item_id]))
+            self.assertEqual(response.status_code, 200)
+        # Lines added after the loss of the cache are numbered after the flushed ones
+        other_id = self.client.post(
+            reverse("cart-items-list", args=[carts[0]]), {"product": self.other.id, "quantity": 1}
+        ).data["id"]
+        self.assertGreater(other_id, max(item_ids))
+
+    def test_item_ids_survive_the_eviction_of_their_counter(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        url = reverse("cart-items-list", args=[cart_id])
+        item_id = self.client.post(url, {"product": self.product.id, "quantity": 1}).data["id"]
+        cache.delete("cart:item:last")
+
+        other_id = self.client.post(url, {"product": self.other.id, "quantity": 1}).data["id"]
+        self.assertGreater(other_id, item_id)
+        call_command("flush_carts", stdout=StringIO())
+        self.assertEqual(CartItem.objects.filter(cart_id=cart_id).count(), 2)
+
+    def test_deleted_cart_is_not_flushed_back(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        self.client.post(reverse("cart-items-list", args=[cart_id]), {"product": self.product.id, "quantity": 1})
+        self.client.delete(reverse("cart-detail", args=[cart_id]))
+
+        call_command("flush_carts", stdout=StringIO())
+        self.assertFalse(Cart.objects.filter(pk=cart_id).exists())
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_unknown_cart(self):
+        url = reverse("cart-items-list", args=["00000000-0000-0000-0000-000000000000"])
+        self.assertEqual(self.client.post(url, {"product": self.product.id, "quantity": 1}).status_code, 404)
+        self.assertEqual(self.client.get(url).data["count"], 0)
+
+    def test_lock_is_only_released_by_its_owner(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        with CacheCartStorage()._lock(cart_id):
+            # Expired meanwhile and taken by another writer
+            cache.set(f"cart:{cart_id}:lock", 12345)
+        self.assertEqual(cache.get(f"cart:{cart_id}:lock"), 12345)
+
+    def test_busy_cart(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        url = reverse("cart-items-list", args=[cart_id])
+        self.client.post(url, {"product": self.product.id, "quantity": 1})
+        cache.set(f"cart:{cart_id}:lock", 12345)
+
+        with mock.patch.object(CacheCartStorage, "lock_wait", 0):
+            self.assertEqual(self.client.post(url, {"product": self.product.id, "quantity": 1}).status_code, 409)
+        # Left to the next flush, which writes it once it is free
+        call_command("flush_carts", stdout=StringIO())
+        self.assertFalse(CartItem.objects.exists())
+        cache.delete(f"cart:{cart_id}:lock")
+        call_command("flush_carts", stdout=StringIO())
+        self.assertEqual(CartItem.objects.get(cart_id=cart_id).quantity, 1)
+
+    def test_quantities_must_be_positive(self):
+        cart_id = self.client.post(reverse("cart-list")).data["id"]
+        url = reverse("cart-items-list", args=[cart_id])
+        self.assertEqual(self.client.post(url, {"product": self.product.id, "quantity": -3}).status_code, 400)
+        self.assertEqual(self.client.post(url, {"product": self.product.id, "quantity": 0}).status_code, 400)
+        with self.assertRaises(ValueError):
+            CacheCartStorage().add_items(cart_id, {self.product.id: -3})
+
+    def test_invalid_lines_do_not_block_the_flush(self):
+        bad = self.client.post(reverse("cart-list")).data["id"]
+        good = self.client.post(reverse("cart-list")).data["id"]
+        self.client.post(reverse("cart-items-list", args=[bad]), {"product": self.product.id, "quantity": 1})
+        self.client.post(reverse("cart-items-list", args=[good]), {"product": self.product.id, "quantity": 2})
+        # As written by a version that did not check quantities
+        entry = cache.get(f"cart:{bad}")
+        entry["lines"][0][2] = -3
+        cache.set(f"cart:{bad}", entry)
+
+        with self.assertLogs("store.cart_storage", "WARNING"):
+            call_command("flush_carts", stdout=StringIO())
+        self.assertFalse(CartItem.objects.filter(cart_id=bad).exists())
+        self.assertEqual(CartItem.objects.get(cart_id=good).quantity, 2)
+
+
+class StreamingExportTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(email="staff@example.com", password="password", username="staff", is_staff=True)
+        cls.customer = User.objects.create_user(email="customer@example.com", password="password", username="customer")
+        cls.category = Category.objects.create(title="Shoes")
+        cls.products = [
+            Product.objects.create(name=f"Product {i}", description="", old_price=10, inventory=5,
+                                   category=cls.category if i % 2 else None)
+            for i in range(5)
+        ]
+        cls.order = Order.objects.create(owner=cls.customer, total_amount=30)
+        for product in cls.products[:3]:
+            OrderItem.objects.create(order=cls.order, product=product, quantity=1, unit_price=10)
+        cls.empty_order = Order.objects.create(owner=cls.customer)
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_product_export_applies_the_list_filters(self):
+        self.assertEqual(len(self.export(reverse("products-export"))), 5)
+        products = self.export(reverse("products-export"), category_id=self.category.id)
+        self.assertEqual({product["id"] for product in products}, {str(p.id) for p in self.products if p.category_id})
+
+    def test_order_export_is_for_staff(self):
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get(reverse("order-export")).status_code, 403)
+
+    def test_order_export_groups_items(self):
+        self.client.force_authenticate(self.staff)
+        orders = {order["id"]: order for order in self.export(reverse("order-export"))}
+        self.assertEqual(len(orders[str(self.order.id)]["items"]), 3)
+        self.assertEqual(orders[str(self.order.id)]["total_amount"], 30)
+        self.assertEqual(orders[str(self.empty_order.id)]["items"], [])
+
+
+@override_settings(API_PROFILING={"SAMPLE_RATE": 1, "N_PLUS_ONE_THRESHOLD": 3})
+class ProfilingMiddlewareTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title="Phones")
+        cls.products = [
+            Product.objects.create(name=f"Phone {i}", description="", old_price=100, inventory=5, category=category)
+            for i in range(4)
+        ]
+
+    def test_profiled_response(self):
+        with self.assertLogs("api.profiling", "INFO") as logs:
+            response = self.client.get(reverse("products-list"))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, total;dur=[\d.]+$')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["path"], reverse("products-list"))
+        self.assertGreater(record["queries"], 0)
+        self.assertGreater(record["serialize_ms"], 0)
+        self.assertEqual(record["n_plus_one"], [])
+
+    def test_n_plus_one_suspects(self):
+        profile = RequestProfile()
+        with connection.execute_wrapper(profile):
+            for product in Product.objects.all():
+                Category.objects.get(pk=product.category_id)
+        [suspect] = profile.n_plus_one_suspects(3)
+        self.assertEqual(suspect["count"], 4)
+        self.assertTrue(suspect["origin"].startswith("api/tests.py:"))
+
+    @override_settings(API_PROFILING={"SAMPLE_RATE": 0})
+    def test_disabled(self):
+        self.assertNotIn("Server-Timing", self.client.get(reverse("products-list")))
+
+
+class MetricsTestCase(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+        self.product = Product.objects.create(name="Phone", description="-", old_price=10, inventory=3)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_timed_by_route_and_action(self):
+        labels = {"route": "products-list", "action": "list"}
+        before = self.sample("api_request_duration_seconds_count", status="2xx", **labels)
+        queries = self.sample("api_request_db_queries_count", **labels)
+        self.client.get(reverse("products-list"))
+        self.assertEqual(self.sample("api_request_duration_seconds_count", status="2xx", **labels), before + 1)
+        self.assertEqual(self.sample("api_request_db_queries_count", **labels), queries + 1)
+
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'api_request_duration_seconds_bucket{action="list"', response.content)
+
+    def test_business_counters(self):
+        hits = self.sample("api_response_cache_requests_total", result="hit")
+        misses = self.sample("api_response_cache_requests_total", result="miss")
+        self.client.get(reverse("products-list"))
+        self.client.get(reverse("products-list"))
+        self.assertEqual(self.sample("api_response_cache_requests_total", result="miss"), misses + 1)
+        self.assertEqual(self.sample("api_response_cache_requests_total", result="hit"), hits + 1)
+
+        added, completed = self.sample("store_cart_lines_added_total"), self.sample("store_checkouts_total", result="completed")
+        cart = Cart.objects.create()
+        self.client.post(reverse("cart-items-list", args=[cart.id]), {"product": self.product.id, "quantity": 2})
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("order-list"), {"cart_id": cart.id})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.sample("store_cart_lines_added_total"), added + 1)
+        self.assertEqual(self.sample("store_checkouts_total", result="completed"), completed + 1)
+
+
+class BenchmarkTestCase(APITestCase):
+    def test_report(self):
+        seed_catalog(categories=2, products=20, carts=2, orders=2)
+        benchmark = Benchmark(parse_mix("browse=1,search=1,cart=1,checkout=1"), seed=1)
+        report = benchmark.report(benchmark.run(iterations=20, workers=1))
+
+        self.assertEqual(report["requests"], sum(endpoint["requests"] for endpoint in report["endpoints"].values()))
+        self.assertIn("POST order-list", report["endpoints"])
+        for label, endpoint in report["endpoints"].items():
+            self.assertLessEqual(endpoint["p50_ms"], endpoint["p99_ms"])
+            self.assertTrue(all(int(status) < 500 for status in endpoint["statuses"]), label)
+        self.assertEqual(report["endpoints"]["GET products-detail"]["max_queries"], 2)
+
+
+class RouteQueryBudgetTestCase(QueryBudgetTestCase):
+    """
+    Every route registered in api/urls.py, measured against a seeded catalog.
+    List budgets are the paginator COUNT(*), the page SELECT and one query per prefetched relation, the
+    ETags of lists are made from the page. Detail budgets include the version stamp of the resources that
+    send ETags.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = seed_catalog()
+        cls.customer = users["customer"]
+        cls.staff = users["staff"]
+        cls.product = Product.objects.first()
+        cls.category = cls.product.category
+        cls.review = cls.product.reviews.first()
+
+        # A cart and an order large enough for any per-line query to blow the budget
+        cls.cart = Cart.objects.create()
+        cls.order = Order.objects.create(owner=cls.customer)
+        for product in Product.objects.all()[:20]:
+            CartItem.objects.create(cart=cls.cart, product=product, quantity=2)
+            OrderItem.objects.create(order=cls.order, product=product, quantity=2)
+        cls.cart_item = cls.cart.cart_items.first()
+        cls.order_item = cls.order.order_items.first()
+
+    def test_every_route_has_a_budget(self):
+        routes = {
+            pattern.name
+            for include_pattern in urls.urlpatterns
+            for pattern in include_pattern.url_patterns
+        }
+        tested = {name[len("test_"):].replace("_", "-") for name in dir(self) if name.startswith("test_")}
+        self.assertEqual(routes - tested, set())
+
+    def test_api_root(self):
+        with self.assertQueryBudget(0):
+            self.client.get(reverse("api-root"))
+
+    def test_categories_list(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse("categories-list"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_categories_detail(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse("categories-detail", args=[self.category.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_products_list(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse("products-list"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_products_list_search(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse("products-list"), {"search": "product 1999"})
+        self.assertEqual(response.data["results"][0]["name"], "Product 1999")
+
+    def test_products_list_cursor(self):
+        # Keyset pages skip the COUNT(*) and never OFFSET, however deep the client walks: the page is the only query
+        url = reverse("products-list") + "?cursor="
+        seen = set()
+        for _ in range(3):
+            with self.assertQueryBudget(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.update(product["id"] for product in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(len(seen), 30)
+
+    def test_products_suggest(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse("products-suggest"), {"q": "prodcut 19"})
+        self.assertEqual(len(response.data), 10)
+
+    def test_products_export(self):
+        # One cursor over the filtered catalog, nothing is counted or paginated
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse("products-export"))
+            products = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(products), Product.objects.count())
+
+    def test_products_detail(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse("products-detail", args=[self.product.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_reviews_list(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse("product-reviews-list", args=[self.product.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_reviews_detail(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse("product-reviews-detail", args=[self.product.id, self.review.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart_list(self):
+        # Only POST is routed on the cart collection, a new cart has no lines to load
+        with self.assertQueryBudget(1):
+            response = self.client.post(reverse("cart-list"))
+        self.assertEqual(response.status_code, 201)
+
+    def test_cart_detail(self):
+        with self.assertQueryBudget(3):
+            response = self.client.get(reverse("cart-detail", args=[self.cart.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["item_count"], 20)
+        self.assertEqual(response.data["grand_total"], sum(item["sub_total"] for item in response.data["cart_items"]))
+
+    def test_cart_items_list(self):
+        # The cart storage hands out every line at once, the page is cut from that list without a COUNT(*)
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse("cart-items-list", args=[self.cart.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart_items_create(self):
+        with self.assertQueryBudget(3):
+            response = self.client.post(
+                reverse("cart-items-list", args=[self.cart.id]), {"product": self.product.id, "quantity": 1}
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_cart_items_bulk(self):
+        # Check the products, upsert every line, touch the cart
+        lines = [{"product": str(product.id), "quantity": 1} for product in Product.objects.all()[10:40]]
+        with self.assertQueryBudget(3):
+            response = self.client.post(reverse("cart-items-bulk", args=[self.cart.id]), lines, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 30)
+
+    def test_cart_items_detail(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse("cart-items-detail", args=[self.cart.id, self.cart_item.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_list(self):
+        self.client.force_authenticate(self.staff)
+        with self.assertQueryBudget(3):
+            response = self.client.get(reverse("order-list"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_detail(self):
+        self.client.force_authenticate(self.customer)
+        with self.assertQueryBudget(3):
+            response = self.client.get(reverse("order-detail", args=[self.order.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["item_count"], 20)
+        self.assertAlmostEqual(response.data["grand_total"], self.order.total_amount)
+
+    def test_order_export(self):
+        # Orders and their items come from the same LEFT JOIN
+        self.client.force_authenticate(self.staff)
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse("order-export"))
+            orders = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(orders), Order.objects.count())
+
+    def test_order_create(self):
+        # Lock the cart, read the lines, reserve stock, insert the order and its items, delete the lines and
+        # the cart, plus the savepoints of the checkout and reservation transactions
+        self.client.force_authenticate(self.customer)
+        with self.assertQueryBudget(11):
+            response = self.client.post(reverse("order-list"), {"cart_id": self.cart.id})
+        self.assertEqual(response.status_code, 201)
+
+    def test_order_items_list(self):
+        self.client.force_authenticate(self.customer)
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse("order-items-list", args=[self.order.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_items_detail(self):
+        self.client.force_authenticate(self.customer)
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse("order-items-detail", args=[self.order.id, self.order_item.id]))
+        self.assertEqual(response.status_code, 200)
@@ -1,4 +1,10 @@
+import uuid
+from itertools import groupby
+from operator import itemgetter
+
 from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin
@@ -6,9 +12,13 @@ from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, IsAuthenticatedOrReadOnly, AllowAny
 
+from django.db.models import Count
+from django.http import Http404
 from django_filters.rest_framework import DjangoFilterBackend
 
-from store.models import Category, Product, Cart, CartItem, Review, Order, OrderItem
+from store.cart_storage import CartBusy, get_cart_storage
+from store.models import Category, Product, Cart, Review, Order, OrderItem
+from store.search import suggest_products
 from .serializers import (
     CategorySerializer,
     AddProductSerializer,
@@ -18,22 +28,38 @@ from .serializers import (
     CartSerializer,
     CartItemSerializer,
     AddCartItemSerializer,
+    CartLineSerializer,
     UpdateCartItemSerializer,
     OrderSerializer,
     CreateOrderSerializer,
     OrderItemSerializer,
 )
-from .filters import ProductFilter
+from .filters import ProductFilter, ProductSearchFilter
+from .pagination import OptInKeysetPagination, OrderOptInKeysetPagination
+from .caching import CachedResponseMixin
+from .conditional import ConditionalGetMixin
+from .idempotency import IDEMPOTENCY_HEADER, IdempotentCreateMixin
+from .streaming import json_stream_response
 from .permisions import IsAuthenticatedAndIsAdminUserOrReadOnly, IsReviewAuthorOrReadOnly
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 
 # Create your views here.
 
+idempotency_key_parameter = openapi.Parameter(
+    IDEMPOTENCY_HEADER,
+    openapi.IN_HEADER,
+    description="Unique key per operation, retries with the same key get the original response back",
+    type=openapi.TYPE_STRING,
+)
+
 
-class CategoryModelViewset(viewsets.ModelViewSet):
+class CategoryModelViewset(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticatedAndIsAdminUserOrReadOnly]
+    list_cache_versions = ["categories"]
+    detail_cache_versions = ["category:{pk}"]
 
     @swagger_auto_schema(tags=["category"])
     def list(self, request, *args, **kwargs):
@@ -60,21 +86,36 @@ class CategoryModelViewset(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class ProductModelViewset(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+class ProductModelViewset(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
+    # Join the category and count reviews in SQL so a page costs a fixed number of queries
+    queryset = Product.objects.select_related("category").annotate(review_count=Count("reviews"))
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedAndIsAdminUserOrReadOnly]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # ProductSearchFilter runs last so relevance ranking takes precedence over the default ordering
+    filter_backends = [DjangoFilterBackend, OrderingFilter, ProductSearchFilter]
     filterset_class = ProductFilter
     search_fields = ["name", "description"]
-    ordering_fields = ["old_price"]
-    pagination_class = PageNumberPagination
+    ordering_fields = ["old_price", "price"]
+    ordering = ["-date_created", "-id"]
+    # Products embed their category, so category changes invalidate them too
+    list_cache_versions = ["products"]
+    detail_cache_versions = ["categories", "product:{pk}"]
+    export_fields = [
+        "id", "name", "slug", "description", "category_id", "old_price", "discount", "price", "inventory",
+        "top_deal", "flash_sales", "date_created",
+    ]
+    export_chunk_size = 2000
+    pagination_class = OptInKeysetPagination
 
 
     def get_serializer_class(self):
         if self.request.method != "GET":
             return AddProductSerializer
         return ProductSerializer
+
+    def get_version_queryset(self):
+        # Category and review changes touch the product, no need for the joins of the queryset
+        return self.filter_queryset(Product.objects.all())
     
     @swagger_auto_schema(tags=["products & reviews"])
     def list(self, request, *args, **kwargs):
@@ -100,13 +141,34 @@ class ProductModelViewset(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @swagger_auto_schema(tags=["products & reviews"], operation_summary="Autocomplete product names")
+    @action(detail=False, methods=["get"])
+    def suggest(self, request, *args, **kwargs):
+        # Called on every keystroke: names and slugs only, straight from the trigram index
+        term = request.query_params.get("q", "").strip()
+        try:
+            limit = min(int(request.query_params.get("limit", 10)), 25)
+        except ValueError:
+            limit = 10
+        if not term or limit < 1:
+            return Response([])
+        return Response(suggest_products(term, limit))
+
+    @swagger_auto_schema(tags=["products & reviews"], operation_summary="Export the whole catalog as one JSON array")
+    @action(detail=False, methods=["get"], pagination_class=None)
+    def export(self, request, *args, **kwargs):
+        # The same filters as the list, but streamed from a server-side cursor instead of paginated
+        products = self.filter_queryset(Product.objects.all()).values(*self.export_fields)
+        return json_stream_response(products.iterator(chunk_size=self.export_chunk_size), "products.json")
+
 
 class ReviewModelViewset(viewsets.ModelViewSet):
     permission_classes = [IsReviewAuthorOrReadOnly]
+    pagination_class = OptInKeysetPagination
 
     def get_queryset(self):
         product_id = self.kwargs.get("product_pk")
-        product_reviews = Review.objects.filter(product_id=product_id)
+        product_reviews = Review.objects.filter(product_id=product_id).select_related("author").order_by("-date_created", "-id")
         return product_reviews
     
 
@@ -150,12 +212,47 @@ class ReviewModelViewset(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class CartGenericViewset(viewsets.GenericViewSet, CreateModelMixin, RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin):
-    queryset = Cart.objects.all()
+class CartBusyError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "The cart is being changed by another request, try again."
+    default_code = "cart_busy"
+
+
+class CartBusyMixin:
+    # The cache cart storage gives up on a cart another request keeps locked, tell the client to retry
+    def handle_exception(self, exc):
+        if isinstance(exc, CartBusy):
+            exc = CartBusyError()
+        return super().handle_exception(exc)
+
+
+class CartGenericViewset(CartBusyMixin, ConditionalGetMixin, viewsets.GenericViewSet, CreateModelMixin, RetrieveModelMixin, UpdateModelMixin, DestroyModelMixin):
+    # Carts are read and written through the cart storage (see store/cart_storage.py), the queryset
+    # only tells the schema generator which model this is
+    queryset = Cart.objects.none()
     serializer_class = CartSerializer
     permission_classes = []
+
+    def get_object(self):
+        cart = get_cart_storage().get(self.kwargs["pk"])
+        if cart is None:
+            raise Http404
+        self.check_object_permissions(self.request, cart)
+        return cart
+
+    def perform_create(self, serializer):
+        serializer.instance = get_cart_storage().create()
+
+    def perform_update(self, serializer):
+        # A cart has no writable field, its lines are edited through /items/
+        serializer.instance = self.get_object()
+
+    def perform_destroy(self, instance):
+        get_cart_storage().delete(instance.pk)
+
+    def get_object_version(self):
+        return get_cart_storage().get_version(self.kwargs["pk"]), None
     
-   
     @swagger_auto_schema(tags=["cart & cart items"])
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
@@ -177,14 +274,21 @@ class CartGenericViewset(viewsets.GenericViewSet, CreateModelMixin, RetrieveMode
         return super().destroy(request, *args, **kwargs)
 
 
-class CartItemModelViewset(viewsets.ModelViewSet):
+class CartItemModelViewset(CartBusyMixin, IdempotentCreateMixin, viewsets.ModelViewSet):
     http_method_names = ["get", "post", "patch", "delete"]
     permission_classes = []
+    max_bulk_lines = 100
 
+    # Lines come from the cart storage, a list rather than a queryset
     def get_queryset(self):
-        cart_id = self.kwargs.get("cart_pk")
-        cart_items = CartItem.objects.filter(cart_id=cart_id)
-        return cart_items
+        return get_cart_storage().items(self.kwargs.get("cart_pk"))
+
+    def get_object(self):
+        item = get_cart_storage().get_item(self.kwargs["cart_pk"], self.kwargs["pk"])
+        if item is None:
+            raise Http404
+        self.check_object_permissions(self.request, item)
+        return item
     
 
     def get_serializer_context(self):
@@ -194,17 +298,22 @@ class CartItemModelViewset(viewsets.ModelViewSet):
     
 
     def get_serializer_class(self):
+        if self.action == "bulk":
+            return CartLineSerializer
         if self.request.method == "POST":
             return AddCartItemSerializer
         elif self.request.method == "PATCH":
             return UpdateCartItemSerializer
         return CartItemSerializer
+
+    def perform_destroy(self, instance):
+        get_cart_storage().remove_item(instance)
     
     @swagger_auto_schema(tags=["cart & cart items"])
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
-    @swagger_auto_schema(tags=["cart & cart items"])
+    @swagger_auto_schema(tags=["cart & cart items"], manual_parameters=[idempotency_key_parameter])
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
     
@@ -224,15 +333,43 @@ class CartItemModelViewset(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        tags=["cart & cart items"],
+        operation_summary="Add many products to a cart",
+        request_body=CartLineSerializer(many=True),
+        responses={201: CartLineSerializer(many=True)},
+        manual_parameters=[idempotency_key_parameter],
+    )
+    @action(detail=False, methods=["post"])
+    def bulk(self, request, *args, **kwargs):
+        # Reorder and wishlist flows: every line in one request, products checked by one query and
+        # lines upserted by one statement
+        def render():
+            serializer = self.get_serializer(data=request.data, many=True, allow_empty=False, max_length=self.max_bulk_lines)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return self.idempotent_response(request, render)
+
 
-class OrderModelViewset(viewsets.ModelViewSet):
+class OrderModelViewset(CartBusyMixin, IdempotentCreateMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderOptInKeysetPagination
+    export_fields = ["id", "owner_id", "order_status", "creation_date", "total_amount"]
+    export_item_fields = ["id", "product_id", "quantity", "unit_price"]
+    export_chunk_size = 2000
 
-    def get_queryset(self):
+    def get_visible_orders(self):
         user = self.request.user
         if user.is_staff:
             return Order.objects.all()
-        return Order.objects.filter(owner=user)
+        return Order.objects.filter(owner_id=user.pk)
+
+    def get_queryset(self):
+        return self.get_visible_orders().prefetch_related("order_items").order_by("-creation_date")
+
+    def get_version_queryset(self):
+        return self.get_visible_orders()
     
     def get_serializer_context(self):
         conext = {"user_id": self.request.user.id}
@@ -248,7 +385,7 @@ class OrderModelViewset(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
     
-    @swagger_auto_schema(tags=["orders & order items"])
+    @swagger_auto_schema(tags=["orders & order items"], manual_parameters=[idempotency_key_parameter])
     def create(self, request, *args, **kwargs):
         return super().create(request, *args, **kwargs)
     
@@ -268,12 +405,73 @@ class OrderModelViewset(viewsets.ModelViewSet):
     def destroy(self, request, *args, **kwargs):
         return super().destroy(request, *args, **kwargs)
 
+    @swagger_auto_schema(tags=["orders & order items"], operation_summary="Export every order with its items (staff)")
+    @action(detail=False, methods=["get"], permission_classes=[IsAdminUser], pagination_class=None)
+    def export(self, request, *args, **kwargs):
+        # One row per item (or per order without items) from a server-side cursor, folded back into orders
+        rows = (
+            Order.objects.order_by("creation_date", "id")
+            .values(*self.export_fields, *[f"order_items__{field}" for field in self.export_item_fields])
+            .iterator(chunk_size=self.export_chunk_size)
+        )
+        return json_stream_response(self.group_export_rows(rows), "orders.json")
+
+    def group_export_rows(self, rows):
+        for _, order_rows in groupby(rows, key=itemgetter("id")):
+            order_rows = list(order_rows)
+            order = {field: order_rows[0][field] for field in self.export_fields}
+            order["items"] = [
+                {field: row[f"order_items__{field}"] for field in self.export_item_fields}
+                for row in order_rows
+                if row["order_items__id"] is not None
+            ]
+            yield order
+
 
 class OrderItemModelViewset(viewsets.ModelViewSet):
-    queryset = OrderItem.objects.all()
     serializer_class = OrderItemSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_order_id(self):
+        # Anything but a UUID in the URL is an order that does not exist
+        try:
+            return uuid.UUID(str(self.kwargs.get("order_pk")))
+        except ValueError:
+            raise Http404
+
+    # The items of the order in the URL, when the user may see it: staff see every order, customers their own
+    def get_visible_orders(self):
+        user = self.request.user
+        orders = Order.objects.filter(pk=self.get_order_id())
+        if user.is_staff:
+            return orders
+        return orders.filter(owner_id=user.pk)
+
+    def get_queryset(self):
+        order_items = OrderItem.objects.filter(order_id=self.get_order_id())
+        if self.request.user.is_staff:
+            return order_items
+        return order_items.filter(order__owner_id=self.request.user.pk)
+
+    # Items are priced at the current price of their product, and every change to the items
+    # recomputes the stored total of their order (which also makes it a new version)
+    def perform_create(self, serializer):
+        if not self.get_visible_orders().exists():
+            raise Http404
+        serializer.save(order_id=self.get_order_id(), unit_price=serializer.validated_data["product"].price)
+        Order.objects.filter(pk=serializer.instance.order_id).update_totals()
+
+    def perform_update(self, serializer):
+        if "product" in serializer.validated_data:
+            serializer.save(unit_price=serializer.validated_data["product"].price)
+        else:
+            serializer.save()
+        Order.objects.filter(pk=serializer.instance.order_id).update_totals()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        Order.objects.filter(pk=instance.order_id).update_totals()
+
 
     @swagger_auto_schema(tags=["orders & order items"])
     def list(self, request, *args, **kwargs):
@@ -56,13 +56,70 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     # "NON_FIELD_ERRORS_KEY":"errors",
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Trusts the user claims of the access token instead of loading the user on every request
+        'accounts.authentication.ClaimsJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
-    "PAGE_SIZE":10
+    "PAGE_SIZE":10,
+    # Proxies in front of the app that append to X-Forwarded-For. At 0 the client IP of the throttles is
+    # REMOTE_ADDR, a header sent by the client is never trusted
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 0)),
+    # Token buckets of the views that hash passwords (see accounts/throttling.py), per client IP and per email
+    "DEFAULT_THROTTLE_RATES": {
+        "login_ip": "20/min",
+        "login_email": "5/min",
+        "signup_ip": "5/min",
+        "signup_email": "3/min",
+    },
+}
+
+# Local memory by default (development and tests), set REDIS_URL to share the cache between workers
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Seconds a cached catalog response is kept, writes invalidate it earlier (see api/caching.py)
+API_CACHE_TIMEOUT = 60 * 15
+# How long responses to POSTs sent with an Idempotency-Key header are replayed (see api/idempotency.py)
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60 * 24
+# Carts untouched for longer than this are deleted by purge_carts (see store/tasks.py)
+ABANDONED_CART_AGE = timedelta(days=30)
+
+# Where carts are kept (see store/cart_storage.py). With a shared cache they live there and only reach the
+# database at checkout or through flush_carts, otherwise they are rows of the cart tables.
+if os.environ.get("REDIS_URL"):
+    CART_STORAGE = "store.cart_storage.CacheCartStorage"
+else:
+    CART_STORAGE = "store.cart_storage.DatabaseCartStorage"
+# Seconds an untouched cart stays in the cache
+CART_STORAGE_TIMEOUT = int(ABANDONED_CART_AGE.total_seconds())
+# Share of the requests profiled by api.profiling.ProfilingMiddleware, 0 turns it off (see api/profiling.py)
+API_PROFILING = {
+    "SAMPLE_RATE": float(os.environ.get("API_PROFILING_SAMPLE_RATE", 0)),
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "api.profiling": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
 }
 
 SIMPLE_JWT = {
@@ -71,7 +128,11 @@ SIMPLE_JWT = {
 
     'SIGNING_KEY': SECRET_KEY,
     'AUTH_HEADER_TYPES': ('Bearer', ),
+    'TOKEN_OBTAIN_SERIALIZER': 'accounts.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_USER_CLASS': 'accounts.authentication.ClaimsUser',
 }
+# Seconds a deactivated user can keep using their tokens when deactivated without a save() (e.g. update())
+AUTH_USER_STATE_TIMEOUT = 60
 
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -85,6 +146,9 @@ SWAGGER_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    # First, so their timings cover the whole stack. Profiling is inactive unless API_PROFILING enables it
+    "api.profiling.ProfilingMiddleware",
+    "api.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -158,6 +222,17 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Argon2 hashes new passwords (and checks the Argon2 hashes made with other parameters), the other hashers only
+# check the passwords hashed before it was added, which are rehashed with Argon2 on the user's next login
+PASSWORD_HASHERS = [
+    "accounts.hashers.TunedArgon2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
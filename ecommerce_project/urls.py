@@ -5,6 +5,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from api.metrics import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(title="E-Commerce API",
     default_version="v1",
@@ -22,4 +24,5 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
     path("auth/", include("accounts.urls")),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -20,9 +20,10 @@ class CartItemAdmin(admin.ModelAdmin):
 
 class OrderAdmin(admin.ModelAdmin):
     list_display = ["id", "creation_date", "owner", "total_amount"]
+    list_select_related = ["owner"]
 
 class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ["order_id", "product", "quantity"]
+    list_display = ["order_id", "product", "quantity", "unit_price"]
 
 
 admin.site.register(Category, CategoryAdmin)
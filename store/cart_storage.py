@@ -0,0 +1,507 @@
+import logging
+import secrets
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.signals import setting_changed
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max, Prefetch
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Cart, CartItem, Product
+
+
+logger = logging.getLogger(__name__)
+
+# Carts are read and written through the storage named by the CART_STORAGE setting:
+# - DatabaseCartStorage keeps them in store_cart/store_cartitem and writes every change right away.
+# - CacheCartStorage keeps them in the cache. Only checkout reaches the database (as an order), and
+#   flush() copies the carts changed since the previous flush to the cart tables (write-behind).
+# Both hand out unsaved Cart and CartItem instances, with the lines and their products loaded, so the
+# serializers work the same whatever the storage.
+
+
+@lru_cache(maxsize=None)
+def get_cart_storage():
+    return import_string(settings.CART_STORAGE)()
+
+
+@receiver(setting_changed)
+def reset_cart_storage(*, setting, **kwargs):
+    if setting == "CART_STORAGE":
+        get_cart_storage.cache_clear()
+
+
+class CartBusy(Exception):
+    """The cart stayed locked by another writer for longer than a writer waits."""
+
+
+def parse_cart_id(cart_id):
+    try:
+        return uuid.UUID(str(cart_id))
+    except ValueError:
+        return None
+
+
+def with_items(cart, items):
+    # Serializers read cart.cart_items.all(), give them the lines as if they had been prefetched
+    cart._prefetched_objects_cache = {"cart_items": items}
+    return cart
+
+
+class BaseCartStorage:
+    def create(self):
+        """Create an empty cart and return it."""
+        raise NotImplementedError
+
+    def get(self, cart_id):
+        """The cart with its lines and their products, or None."""
+        raise NotImplementedError
+
+    def get_version(self, cart_id):
+        """When the cart, or a product in it, last changed. None for an unknown cart."""
+        raise NotImplementedError
+
+    def delete(self, cart_id):
+        """Delete the cart and its lines, return whether it existed."""
+        raise NotImplementedError
+
+    def items(self, cart_id):
+        """The lines of the cart with their products, empty for an unknown cart."""
+        raise NotImplementedError
+
+    def get_item(self, cart_id, item_id):
+        """One line of the cart with its product, or None."""
+        raise NotImplementedError
+
+    def add_item(self, cart_id, product_id, quantity):
+        """Add a quantity of a product to the cart and return the line. Raises Cart.DoesNotExist."""
+        return self.add_items(cart_id, {product_id: quantity})[0]
+
+    def add_items(self, cart_id, quantities):
+        """
+        add_item() for several products at once, ``quantities`` maps product ids to quantities. Raises ValueError
+        for a quantity below 1.
+        """
+        raise NotImplementedError
+
+    def update_item(self, item, quantity):
+        """Change the quantity of a line returned by get_item() and return it. Raises ValueError below 0."""
+        raise NotImplementedError
+
+    def remove_item(self, item):
+        """Remove a line returned by get_item()."""
+        raise NotImplementedError
+
+    def lock(self, cart_id):
+        """
+        Keep concurrent writers off the cart until the block ends. Checkout holds it from the moment it reads
+        the lines until its transaction is committed.
+        """
+        return nullcontext()
+
+    def checkout_lines(self, cart_id):
+        """
+        ``(product_id, quantity, price)`` of every line, with the current price of the product. Called inside
+        lock() and the checkout transaction, which then deletes the cart.
+        """
+        raise NotImplementedError
+
+    def flush(self, batch_size=1000):
+        """Copy pending changes to the database, return the number of carts written."""
+        return 0
+
+
+class DatabaseCartStorage(BaseCartStorage):
+    lines_prefetch = Prefetch("cart_items", queryset=CartItem.objects.select_related("product"))
+
+    def create(self):
+        return with_items(Cart.objects.create(), [])
+
+    def get(self, cart_id):
+        if parse_cart_id(cart_id) is None:
+            return None
+        return Cart.objects.prefetch_related(self.lines_prefetch).filter(pk=cart_id).first()
+
+    def get_version(self, cart_id):
+        if parse_cart_id(cart_id) is None:
+            return None
+        # Lines change the cart's updated_at, but the products they show (name, price) change on their own
+        stamp = (
+            Cart.objects.filter(pk=cart_id)
+            .annotate(products_updated_at=Max("cart_items__product__updated_at"))
+            .values_list("updated_at", "products_updated_at")
+            .first()
+        )
+        return max(filter(None, stamp)) if stamp else None
+
+    def delete(self, cart_id):
+        if parse_cart_id(cart_id) is None:
+            return False
+        # Nothing listens to cart deletions, skip the collector and delete the lines and the cart directly
+        CartItem.objects.filter(cart_id=cart_id)._raw_delete(CartItem.objects.db)
+        return Cart.objects.filter(pk=cart_id)._raw_delete(Cart.objects.db) > 0
+
+    def items(self, cart_id):
+        if parse_cart_id(cart_id) is None:
+            return []
+        return list(CartItem.objects.filter(cart_id=cart_id).select_related("product"))
+
+    def get_item(self, cart_id, item_id):
+        if parse_cart_id(cart_id) is None or not str(item_id).isdigit():
+            return None
+        return CartItem.objects.filter(cart_id=cart_id, pk=item_id).select_related("product").first()
+
+    # Every change to the lines is a new version of the cart
+    def add_items(self, cart_id, quantities):
+        # Touched first: an unknown cart is reported before the lines would fail on their foreign key,
+        # and the cart row stays locked against a concurrent checkout until the lines are in
+        if parse_cart_id(cart_id) is None or not Cart.touch(cart_id):
+            raise Cart.DoesNotExist
+        # One statement upserts every line
+        return CartItem.objects.add_many(cart_id, quantities)
+
+    def update_item(self, item, quantity):
+        item.quantity = quantity
+        item.save(update_fields=["quantity"])
+        Cart.touch(item.cart_id)
+        return item
+
+    def remove_item(self, item):
+        item.delete()
+        Cart.touch(item.cart_id)
+
+    # No lock() of its own, checkout_lines() locks the cart row
+    def checkout_lines(self, cart_id):
+        if parse_cart_id(cart_id) is None:
+            return []
+        # The cart row stays locked until the checkout transaction ends: a concurrent checkout waits and then
+        # finds no cart, and lines added meanwhile wait too instead of being deleted unseen
+        if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+            return []
+        return list(CartItem.objects.filter(cart_id=cart_id).values_list("product_id", "quantity", "product__price"))
+
+
+class CacheCartStorage(BaseCartStorage):
+    """
+    A cart is one cache entry: {"id", "created", "updated", "lines": [[item_id, product_id, quantity]]}.
+    Writes to an entry, flush() included, are serialized by a short lock in the cache, and recorded in a journal
+    of numbered keys that flush() replays. Item ids come from a counter shared by every cart and are kept by the
+    database copy, so a cart that is no longer in the cache is read back with the same item ids.
+    """
+    key_prefix = "cart"
+    journal_head_key = "cart:journal:head"
+    journal_flushed_key = "cart:journal:flushed"
+    item_id_key = "cart:item:last"
+    # Seconds a writer may hold a cart, the lock expires on its own if the writer dies
+    lock_timeout = 5
+    # Seconds a writer waits for a cart before giving up with CartBusy
+    lock_wait = 2
+    # Carts locked at once by flush(), few enough to be written well within lock_timeout
+    flush_lock_size = 50
+
+    def _key(self, cart_id):
+        return f"{self.key_prefix}:{cart_id}"
+
+    def _journal_key(self, sequence):
+        return f"{self.key_prefix}:journal:{sequence}"
+
+    # Locks held by the current thread, a writer that holds a cart may call methods that lock it again
+    _held = threading.local()
+
+    @contextmanager
+    def _lock(self, cart_id, wait=None):
+        key = f"{self._key(cart_id)}:lock"
+        held = self._held.__dict__.setdefault("keys", set())
+        if key in held:
+            yield
+            return
+        # Whose lock it is: an expired lock may have been taken by another writer by the time it is released
+        token = secrets.randbits(62)
+        deadline = time.monotonic() + (self.lock_wait if wait is None else wait)
+        while not cache.add(key, token, self.lock_timeout):
+            if time.monotonic() >= deadline:
+                raise CartBusy(cart_id)
+            time.sleep(0.005)
+        held.add(key)
+        try:
+            yield
+        finally:
+            held.discard(key)
+            self._release(key, token)
+
+    def _release(self, key, token):
+        backend = caches[DEFAULT_CACHE_ALIAS]
+        if isinstance(backend, RedisCache):
+            # Compare and delete in one step (integers are stored as they are, not pickled)
+            client = backend._cache.get_client(key, write=True)
+            client.eval(
+                "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0",
+                1, backend.make_and_validate_key(key), str(token),
+            )
+        elif cache.get(key) == token:
+            # Other backends have no such operation, the window between the two calls is left open
+            cache.delete(key)
+
+    def _load(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return None
+        entry = cache.get(self._key(cart_id))
+        if entry is not None:
+            return entry
+
+        cart = Cart.objects.filter(pk=cart_id).values_list("date_created", "updated_at").first()
+        if cart is None:
+            return None
+        lines = CartItem.objects.filter(cart_id=cart_id).order_by("id").values_list("id", "product_id", "quantity")
+        entry = {
+            "id": cart_id,
+            "created": cart[0],
+            "updated": cart[1],
+            "lines": [list(line) for line in lines],
+        }
+        cache.set(self._key(cart_id), entry, settings.CART_STORAGE_TIMEOUT)
+        return entry
+
+    def _next_item_ids(self, count):
+        try:
+            last = cache.incr(self.item_id_key, count)
+        except ValueError:
+            # Started, or evicted, after the ids of the flushed copies and of the carts waiting to be flushed
+            flushed = CartItem.objects.aggregate(last=Max("id"))["last"] or 0
+            cache.add(self.item_id_key, max(flushed, self._last_pending_item_id()), timeout=None)
+            last = cache.incr(self.item_id_key, count)
+        return iter(range(last - count + 1, last + 1))
+
+    def _pending_journal(self):
+        """The range of journal entries flush() has not replayed yet."""
+        head = cache.get(self.journal_head_key, 0)
+        flushed = cache.get(self.journal_flushed_key, 0)
+        if flushed > head:
+            # The journal was started over
+            flushed = 0
+        return range(flushed + 1, head + 1)
+
+    def _last_pending_item_id(self, batch_size=1000):
+        last = 0
+        pending = self._pending_journal()
+        for start in range(0, len(pending), batch_size):
+            journal_keys = [self._journal_key(sequence) for sequence in pending[start:start + batch_size]]
+            cart_ids = set(cache.get_many(journal_keys).values())
+            for entry in cache.get_many([self._key(cart_id) for cart_id in cart_ids]).values():
+                last = max([last] + [item_id for item_id, _, _ in entry["lines"]])
+        return last
+
+    def _save(self, entry):
+        entry["updated"] = timezone.now()
+        cache.set(self._key(entry["id"]), entry, settings.CART_STORAGE_TIMEOUT)
+        self._journal(entry["id"])
+
+    def _journal(self, cart_id):
+        cache.add(self.journal_head_key, 0, timeout=None)
+        try:
+            sequence = cache.incr(self.journal_head_key)
+        except ValueError:
+            # Evicted between add() and incr(), flush() starts the journal over
+            sequence = 1
+            cache.set(self.journal_head_key, sequence, timeout=None)
+        cache.set(self._journal_key(sequence), cart_id, settings.CART_STORAGE_TIMEOUT)
+
+    def _build_items(self, entry, lines):
+        products = Product.objects.in_bulk([product_id for _, product_id, _ in lines])
+        return [
+            CartItem(id=item_id, cart_id=entry["id"], product=products[product_id], quantity=quantity)
+            for item_id, product_id, quantity in lines
+            if product_id in products
+        ]
+
+    def create(self):
+        now = timezone.now()
+        entry = {"id": uuid.uuid4(), "created": now, "updated": now, "lines": []}
+        # Not journaled, empty carts never reach the database
+        cache.set(self._key(entry["id"]), entry, settings.CART_STORAGE_TIMEOUT)
+        return with_items(Cart(id=entry["id"], date_created=now, updated_at=now), [])
+
+    def get(self, cart_id):
+        entry = self._load(cart_id)
+        if entry is None:
+            return None
+        cart = Cart(id=entry["id"], date_created=entry["created"], updated_at=entry["updated"])
+        return with_items(cart, self._build_items(entry, entry["lines"]))
+
+    def get_version(self, cart_id):
+        entry = self._load(cart_id)
+        if entry is None:
+            return None
+        if not entry["lines"]:
+            return entry["updated"]
+        product_ids = [product_id for _, product_id, _ in entry["lines"]]
+        products_updated_at = Product.objects.filter(pk__in=product_ids).aggregate(stamp=Max("updated_at"))["stamp"]
+        return max(filter(None, [entry["updated"], products_updated_at]))
+
+    def delete(self, cart_id):
+        cart_id = parse_cart_id(cart_id)
+        if cart_id is None:
+            return False
+        # Locked, so a flush in progress does not write the cart back behind the deletion
+        with self._lock(cart_id):
+            deleted = cache.delete(self._key(cart_id))
+            # Along with the write-behind copy, if the cart was ever flushed
+            return DatabaseCartStorage().delete(cart_id) or deleted
+
+    def items(self, cart_id):
+        entry = self._load(cart_id)
+        return self._build_items(entry, entry["lines"]) if entry else []
+
+    def get_item(self, cart_id, item_id):
+        entry = self._load(cart_id)
+        if entry is None:
+            return None
+        lines = [line for line in entry["lines"] if str(line[0]) == str(item_id)]
+        items = self._build_items(entry, lines)
+        return items[0] if items else None
+
+    # The cart tables would refuse negative quantities, the cache has to be told
+    def add_items(self, cart_id, quantities):
+        if any(quantity < 1 for quantity in quantities.values()):
+            raise ValueError("Quantities added to a cart must be at least 1")
+        with self._lock(cart_id):
+            entry = self._load(cart_id)
+            if entry is None:
+                raise Cart.DoesNotExist
+            lines = {line[1]: line for line in entry["lines"]}
+            new = [product_id for product_id in quantities if product_id not in lines]
+            item_ids = self._next_item_ids(len(new)) if new else iter(())
+            for product_id, quantity in quantities.items():
+                if product_id in lines:
+                    lines[product_id][2] += quantity
+                else:
+                    lines[product_id] = [next(item_ids), product_id, quantity]
+                    entry["lines"].append(lines[product_id])
+            self._save(entry)
+        return [
+            CartItem(id=lines[product_id][0], cart_id=entry["id"], product_id=product_id, quantity=lines[product_id][2])
+            for product_id in quantities
+        ]
+
+    def update_item(self, item, quantity):
+        if quantity < 0:
+            raise ValueError("Cart quantities cannot be negative")
+        with self._lock(item.cart_id):
+            entry = self._load(item.cart_id)
+            if entry is not None:
+                for line in entry["lines"]:
+                    if line[0] == item.pk:
+                        line[2] = quantity
+                self._save(entry)
+        item.quantity = quantity
+        return item
+
+    def remove_item(self, item):
+        with self._lock(item.cart_id):
+            entry = self._load(item.cart_id)
+            if entry is not None:
+                entry["lines"] = [line for line in entry["lines"] if line[0] != item.pk]
+                self._save(entry)
+
+    def lock(self, cart_id):
+        return self._lock(cart_id)
+
+    def checkout_lines(self, cart_id):
+        with self._lock(cart_id):
+            entry = self._load(cart_id)
+        if entry is None:
+            return []
+        prices = dict(
+            Product.objects.filter(pk__in=[product_id for _, product_id, _ in entry["lines"]]).values_list("pk", "price")
+        )
+        return [
+            (product_id, quantity, prices[product_id])
+            for _, product_id, quantity in entry["lines"]
+            if product_id in prices
+        ]
+
+    def flush(self, batch_size=1000):
+        """
+        Write the carts journaled since the previous flush to the cart tables, ``batch_size`` journal entries
+        read at a time. Their carts are locked and written ``flush_lock_size`` at a time, one transaction each.
+        Carts that were deleted or checked out in the meantime are skipped, and carts locked by a writer are
+        left to the next flush. Run one flush at a time (from a scheduler, see store/tasks.py).
+        """
+        pending = self._pending_journal()
+        written = 0
+        for start in range(0, len(pending), batch_size):
+            sequences = pending[start:start + batch_size]
+            end = sequences[-1]
+            journal_keys = [self._journal_key(sequence) for sequence in sequences]
+            cart_ids = sorted(set(cache.get_many(journal_keys).values()), key=str)
+            for index in range(0, len(cart_ids), self.flush_lock_size):
+                written += self._flush_carts(cart_ids[index:index + self.flush_lock_size])
+            cache.set(self.journal_flushed_key, end, timeout=None)
+            # Replayed, the journal does not keep one key per write until they expire
+            cache.delete_many(journal_keys)
+        return written
+
+    def _flush_carts(self, cart_ids):
+        with ExitStack() as stack:
+            locked = []
+            for cart_id in cart_ids:
+                try:
+                    stack.enter_context(self._lock(cart_id, wait=0))
+                except CartBusy:
+                    # Journaled again for the next flush rather than keeping the other carts waiting
+                    self._journal(cart_id)
+                else:
+                    locked.append(cart_id)
+            # Read under the locks: a cart deleted before them is gone, one deleted after them waits
+            entries = list(cache.get_many([self._key(cart_id) for cart_id in locked]).values())
+            return self._write(entries)
+
+    @staticmethod
+    def _storable(quantity):
+        return isinstance(quantity, int) and quantity >= 0
+
+    def _write(self, entries):
+        if not entries:
+            return 0
+        # Products deleted since they were added to a cart are left out, and so are lines the cart tables would
+        # refuse: written by an older version, they would fail every flush after them
+        product_ids = {product_id for entry in entries for _, product_id, _ in entry["lines"]}
+        existing = set(Product.objects.filter(pk__in=product_ids).values_list("pk", flat=True))
+        for entry in entries:
+            invalid = [line for line in entry["lines"] if not self._storable(line[2])]
+            if invalid:
+                logger.warning("Cart %s: lines with invalid quantities not flushed: %s", entry["id"], invalid)
+        cart_ids = [entry["id"] for entry in entries]
+
+        with transaction.atomic():
+            # date_created and updated_at are stamped by the database copy, with the time of the flush
+            Cart.objects.bulk_create(
+                [Cart(id=entry["id"]) for entry in entries],
+                update_conflicts=True,
+                unique_fields=["id"],
+                update_fields=["updated_at"],
+            )
+            CartItem.objects.filter(cart_id__in=cart_ids)._raw_delete(CartItem.objects.db)
+            CartItem.objects.bulk_create([
+                CartItem(id=item_id, cart_id=entry["id"], product_id=product_id, quantity=quantity)
+                for entry in entries
+                for item_id, product_id, quantity in entry["lines"]
+                if product_id in existing and self._storable(quantity)
+            ])
+            # The ids were given, move the sequence past them for lines the database numbers itself
+            connection = connections[CartItem.objects.db]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [CartItem]):
+                    cursor.execute(sql)
+        return len(entries)
@@ -0,0 +1,59 @@
+import csv
+import json
+import sys
+from contextlib import contextmanager
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+# Product files exchanged with import_products/export_products, one product per CSV row or JSON line.
+# Products are identified by their slug, and their category by the category's slug.
+
+PRODUCT_COLUMNS = [
+    "slug", "name", "description", "category", "old_price", "discount", "inventory", "top_deal", "flash_sales",
+]
+FORMATS = ["csv", "jsonl"]
+
+
+def detect_format(path, format=None):
+    if format:
+        return format
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "csv"
+
+
+@contextmanager
+def open_file(path, mode):
+    """Open ``path``, or stdin/stdout for "-", as text."""
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+        return
+    # utf-8-sig reads files saved by spreadsheets with a BOM
+    with open(path, mode, newline="", encoding="utf-8-sig" if mode == "r" else "utf-8") as file:
+        yield file
+
+
+def read_rows(file, format):
+    """Yield the rows of ``file`` one at a time as dicts, whatever its size."""
+    if format == "csv":
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class RowWriter:
+    def __init__(self, file, format):
+        self.format = format
+        self.file = file
+        if format == "csv":
+            self.writer = csv.DictWriter(file, fieldnames=PRODUCT_COLUMNS)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.format == "csv":
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
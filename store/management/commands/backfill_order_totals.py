@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from store.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Record the price paid on order items that predate unit_price, using the current product price, "
+        "and recompute the stored total_amount of every order. Safe to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Orders updated per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        order_ids = Order.objects.order_by("pk").values_list("pk", flat=True)
+
+        batch, items, orders = [], 0, 0
+        for order_id in order_ids.iterator(chunk_size=batch_size):
+            batch.append(order_id)
+            if len(batch) == batch_size:
+                items, orders = self.backfill(batch, items, orders)
+                batch = []
+        if batch:
+            items, orders = self.backfill(batch, items, orders)
+
+        self.stdout.write(self.style.SUCCESS(f"Priced {items} order items, updated the totals of {orders} orders"))
+
+    def backfill(self, order_ids, items, orders):
+        # One short transaction per batch so a large table is never locked as a whole
+        with transaction.atomic():
+            items += OrderItem.objects.filter(order_id__in=order_ids).snapshot_prices()
+            orders += Order.objects.filter(pk__in=order_ids).update_totals()
+        return items, orders
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.catalog_files import FORMATS, PRODUCT_COLUMNS, RowWriter, detect_format, open_file
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Write every product to a CSV or JSON lines file that import_products can read back, in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-", help='File to write, "-" (the default) for stdout')
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension, csv otherwise")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Rows fetched from the database at a time")
+
+    def handle(self, *args, **options):
+        sources = {"category": "category__slug"}
+        products = Product.objects.order_by("pk").values_list(*[sources.get(column, column) for column in PRODUCT_COLUMNS])
+
+        start = time.perf_counter()
+        count = 0
+        with open_file(options["path"], "w") as file:
+            writer = RowWriter(file, detect_format(options["path"], options["format"]))
+            for values in products.iterator(chunk_size=options["chunk_size"]):
+                writer.write(dict(zip(PRODUCT_COLUMNS, values)))
+                count += 1
+        elapsed = time.perf_counter() - start
+
+        # The products themselves may be going to stdout
+        rate = count / elapsed if elapsed else 0
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} products in {elapsed:.2f}s ({rate:.0f} rows/s)"))
@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.tasks import flush_carts
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the carts changed in the cache since the previous run to the cart tables, so they survive the "
+        "loss of the cache. Only does something with the cache cart storage, run it every few minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Journal entries written per transaction")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        carts = flush_carts(batch_size=options["batch_size"])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {carts} carts in {elapsed:.2f}s with {settings.CART_STORAGE.rsplit('.', 1)[-1]}"
+        ))
@@ -0,0 +1,128 @@
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.defaultfilters import slugify
+from django.utils import timezone
+
+from store.catalog_files import FORMATS, detect_format, open_file, read_rows
+from store.models import Category, Product
+from store.signals import products_bulk_saved
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in {"1", "true", "yes", "y", "t"}
+
+
+# Columns copied to the product, with their conversion. "slug" and "category" are resolved separately.
+CONVERTERS = {
+    "name": str,
+    "description": str,
+    "old_price": float,
+    "discount": parse_bool,
+    "inventory": int,
+    "top_deal": parse_bool,
+    "flash_sales": parse_bool,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products from a CSV or JSON lines file of any size, matched on their slug "
+        "(computed from the name when the file has none). Columns missing from a row are left unchanged. "
+        "Rows whose slug is shared by several products are skipped, there is no telling which one they update."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help='File to import, "-" for stdin')
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension, csv otherwise")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows written per transaction")
+
+    def handle(self, *args, **options):
+        # Resolved from memory for every row, categories are few
+        self.categories = dict(Category.objects.values_list("slug", "id"))
+        self.created = self.updated = self.skipped = 0
+
+        start = time.perf_counter()
+        with open_file(options["path"], "r") as file:
+            rows = enumerate(read_rows(file, detect_format(options["path"], options["format"])), start=1)
+            while chunk := list(islice(rows, options["chunk_size"])):
+                self.import_chunk(chunk)
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"{chunk[-1][0]} rows read")
+        elapsed = time.perf_counter() - start
+
+        rate = (self.created + self.updated + self.skipped) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {self.created}, updated {self.updated} and skipped {self.skipped} products "
+            f"in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        ))
+
+    def skip(self, number, reason):
+        self.skipped += 1
+        self.stderr.write(f"Row {number} skipped: {reason}")
+
+    def parse(self, number, row):
+        """The product fields of a row, None when it cannot be imported."""
+        fields = {}
+        for column, convert in CONVERTERS.items():
+            if row.get(column) not in (None, ""):
+                try:
+                    fields[column] = convert(row[column])
+                except (TypeError, ValueError):
+                    return self.skip(number, f"invalid {column} {row[column]!r}")
+
+        category = row.get("category")
+        if category:
+            if category not in self.categories:
+                return self.skip(number, f"unknown category {category!r}")
+            fields["category_id"] = self.categories[category]
+
+        fields["slug"] = row.get("slug") or slugify(fields.get("name", ""))
+        if not fields["slug"]:
+            return self.skip(number, "no slug and no name")
+        return fields
+
+    def import_chunk(self, chunk):
+        rows = {}
+        for number, row in chunk:
+            fields = self.parse(number, row)
+            if fields is not None:
+                # The last row wins when a slug appears twice
+                rows[fields["slug"]] = (number, fields)
+
+        # Slugs are not unique, products with the same name share one
+        existing = defaultdict(list)
+        for product in Product.objects.filter(slug__in=rows):
+            existing[product.slug].append(product)
+        now = timezone.now()
+        created, updated, updated_fields = [], [], {"updated_at"}
+        for slug, (number, fields) in rows.items():
+            matches = existing.get(slug, [])
+            if len(matches) > 1:
+                self.skip(number, f"slug {slug!r} matches {len(matches)} products")
+            elif matches:
+                product = matches[0]
+                for name, value in fields.items():
+                    setattr(product, name, value)
+                # bulk_update() leaves auto_now fields alone
+                product.updated_at = now
+                updated_fields.update(fields)
+                updated.append(product)
+            elif "name" in fields and "inventory" in fields:
+                created.append(Product(**{"description": "", **fields}))
+            else:
+                self.skip(number, "a new product needs a name and an inventory")
+
+        # bulk_create() and bulk_update() skip save(), its slugify() and the post_save signals
+        with transaction.atomic():
+            Product.objects.bulk_create(created)
+            Product.objects.bulk_update(updated, sorted(updated_fields - {"slug"}))
+        products_bulk_saved.send(sender=Product, products=created + updated)
+
+        self.created += len(created)
+        self.updated += len(updated)
@@ -0,0 +1,47 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.tasks import purge_carts_in_batches
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete carts that were not touched for a while, in small batches. "
+        "Can be interrupted at any time and run again, it picks up what is left."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=float,
+            default=settings.ABANDONED_CART_AGE / timedelta(days=1),
+            help="Age in days after which an untouched cart is abandoned (default: ABANDONED_CART_AGE)",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Carts deleted per transaction")
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+        parser.add_argument("--max-batches", type=int, default=None, help="Stop after this many batches")
+
+    def handle(self, *args, **options):
+        batches = purge_carts_in_batches(
+            max_age=timedelta(days=options["days"]),
+            batch_size=options["batch_size"],
+            pause=options["pause"],
+            max_batches=options["max_batches"],
+        )
+
+        carts = items = 0
+        start = time.perf_counter()
+        for number, (batch_carts, batch_items) in enumerate(batches, start=1):
+            carts += batch_carts
+            items += batch_items
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Batch {number}: {batch_carts} carts, {batch_items} items")
+        elapsed = time.perf_counter() - start
+
+        rate = (carts + items) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {carts} carts and {items} items in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        ))
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:48
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0004_remove_review_author_name_review_author"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="price",
+            field=models.GeneratedField(
+                db_index=True,
+                db_persist=True,
+                expression=models.Case(
+                    models.When(
+                        discount=True,
+                        then=django.db.models.expressions.CombinedExpression(
+                            models.F("old_price"),
+                            "-",
+                            django.db.models.expressions.CombinedExpression(
+                                models.Value(0.3), "*", models.F("old_price")
+                            ),
+                        ),
+                    ),
+                    default=models.F("old_price"),
+                ),
+                output_field=models.FloatField(),
+            ),
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+
+
+# The search index lives outside the ORM model: PostgreSQL maintains a generated column,
+# SQLite (local development and tests) gets an FTS5 table synced by store/signals.py.
+
+POSTGRES_FORWARDS = [
+    """
+    ALTER TABLE store_product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX product_search_vector_idx ON store_product USING gin (search_vector)",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS product_search_vector_idx",
+    "ALTER TABLE store_product DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE store_product_fts USING fts5(product_id UNINDEXED, name, description)",
+    "INSERT INTO store_product_fts (product_id, name, description) SELECT id, name, description FROM store_product",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TABLE IF EXISTS store_product_fts",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store", "0006_keyset_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"postgresql": POSTGRES_FORWARDS, "sqlite": SQLITE_FORWARDS}),
+            run_for_vendor({"postgresql": POSTGRES_BACKWARDS, "sqlite": SQLITE_BACKWARDS}),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+# Trigram index on product names for the typo-tolerant /api/products/suggest/ endpoint,
+# see store/search.py. Names are padded with spaces on SQLite so word boundaries count like in pg_trgm.
+
+POSTGRES_FORWARDS = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX product_name_trgm_idx ON store_product USING gin (name gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS product_name_trgm_idx",
+]
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE store_product_name_trgm USING fts5(product_id UNINDEXED, name, tokenize='trigram')",
+    "INSERT INTO store_product_name_trgm (product_id, name) SELECT id, ' ' || name || ' ' FROM store_product",
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TABLE IF EXISTS store_product_name_trgm",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store", "0007_product_search"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"postgresql": POSTGRES_FORWARDS, "sqlite": SQLITE_FORWARDS}),
+            run_for_vendor({"postgresql": POSTGRES_BACKWARDS, "sqlite": SQLITE_BACKWARDS}),
+        ),
+    ]
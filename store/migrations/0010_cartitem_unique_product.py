@@ -0,0 +1,35 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Concurrent adds could create several lines for the same product, fold them into the oldest one
+    CartItem = apps.get_model("store", "CartItem")
+    duplicates = (
+        CartItem.objects.values("cart_id", "product_id")
+        .annotate(lines=Count("id"), keep=Min("id"), total_quantity=Sum("quantity"))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        lines = CartItem.objects.filter(cart_id=duplicate["cart_id"], product_id=duplicate["product_id"])
+        lines.filter(id=duplicate["keep"]).update(quantity=duplicate["total_quantity"])
+        lines.exclude(id=duplicate["keep"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0009_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                fields=("cart", "product"), name="cartitem_cart_product_unique"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0010_cartitem_unique_product"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="orderitem",
+            name="unit_price",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
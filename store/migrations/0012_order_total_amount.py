@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0011_orderitem_unit_price"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="total_amount",
+            field=models.FloatField(default=0.0),
+        ),
+    ]
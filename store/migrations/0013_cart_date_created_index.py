@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("store", "0012_order_total_amount"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="cart",
+            name="date_created",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
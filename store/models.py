@@ -1,6 +1,9 @@
 from typing import Iterable
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 
 from django.template.defaultfilters import slugify
 
@@ -10,6 +13,23 @@ import uuid
 
 User = get_user_model()
 
+# Applied to the old price of products that are on discount
+DISCOUNT_RATE = 30/100
+
+class VersionedModel(models.Model):
+    # Version stamp behind the ETag/Last-Modified headers of the api (see api/conditional.py).
+    # Bumped on save(), and with touch() when a change to related rows alters the representation.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def touch(cls, *pks):
+        """Bump the version of these rows, return how many exist."""
+        return cls.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
 class Category(models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, unique=True)
     title = models.CharField(max_length=100)
@@ -25,7 +45,36 @@ class Category(models.Model):
         self.slug = slugify(self.title)
         return super().save(**kwargs)
 
-class Product(models.Model):
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        super().__init__(f"Not enough stock for products {', '.join(str(pk) for pk in product_ids)}")
+        self.product_ids = product_ids
+
+
+class ProductQuerySet(models.QuerySet):
+    def reserve(self, quantities):
+        """
+        Take stock for several products at once, all or nothing. ``quantities`` maps product ids to quantities.
+        One conditional UPDATE ... SET inventory = inventory - qty WHERE inventory >= qty covers every product,
+        so concurrent checkouts can never both take the last units. Raises OutOfStock and leaves the
+        inventory untouched when any product lacks stock.
+        """
+        if not quantities:
+            return
+        wanted = Case(*[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()], output_field=models.IntegerField())
+        try:
+            with transaction.atomic(using=self.db):
+                reserved = self.filter(pk__in=quantities, inventory__gte=wanted).update(
+                    inventory=F("inventory") - wanted, updated_at=timezone.now()
+                )
+                if reserved != len(quantities):
+                    raise OutOfStock([])
+        except OutOfStock:
+            available = set(self.filter(pk__in=quantities, inventory__gte=wanted).values_list("pk", flat=True))
+            raise OutOfStock([pk for pk in quantities if pk not in available])
+
+
+class Product(VersionedModel):
     id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, unique=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
@@ -38,15 +87,26 @@ class Product(models.Model):
     date_created = models.DateTimeField(auto_now_add=True)
     top_deal = models.BooleanField(default=False)
     flash_sales = models.BooleanField(default=False)
+    # Computed and stored by the database on every insert and update (including bulk ones),
+    # so the effective price can be filtered, ordered and summed in SQL
+    price = models.GeneratedField(
+        expression=Case(
+            When(discount=True, then=F("old_price") - DISCOUNT_RATE * F("old_price")),
+            default=F("old_price"),
+        ),
+        output_field=models.FloatField(),
+        db_persist=True,
+        db_index=True,
+    )
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the catalog
+            models.Index(fields=["date_created", "id"], name="product_created_id_idx"),
+        ]
 
-    @property
-    def price(self):
-        if self.discount:
-            new_price = self.old_price - (30/100) * self.old_price
-        else:
-            new_price = self.old_price
-        return new_price
-    
     def __str__(self):
         return self.name
     
@@ -61,26 +121,117 @@ class Review(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reviews")
     date_created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a product's reviews
+            models.Index(fields=["product", "date_created", "id"], name="review_product_created_id_idx"),
+        ]
+
 
-class Cart(models.Model):
+class Cart(VersionedModel):
     id = models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, unique=True)
     # owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
-    date_created = models.DateTimeField(auto_now_add=True)
+    # Indexed for the purge of abandoned carts (see store/tasks.py)
+    date_created = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return str(self.id)
 
 
+class CartItemManager(models.Manager):
+    def add(self, cart_id, product_id, quantity):
+        """
+        Add ``quantity`` of a product to a cart: insert the line, or increment it when the product is already
+        in the cart. A single INSERT ... ON CONFLICT DO UPDATE where the database supports it, so concurrent
+        adds of the same product neither lose increments nor create duplicate lines.
+        """
+        return self.add_many(cart_id, {product_id: quantity})[0]
+
+    def add_many(self, cart_id, quantities):
+        """
+        Like add() for several products at once, ``quantities`` maps product ids to quantities. Every line is
+        upserted by the same statement, and the lines are returned in the order of ``quantities``.
+        """
+        product_field = self.model._meta.get_field("product")
+        # Sorted, so concurrent adds to the same cart lock its lines in the same order
+        product_ids = sorted(quantities, key=str)
+
+        connection = connections[self.db]
+        if not (connection.features.supports_update_conflicts_with_target and connection.features.can_return_columns_from_insert):
+            with transaction.atomic(using=self.db):
+                lines = {product_id: self._add_with_retry(cart_id, product_id, quantities[product_id]) for product_id in product_ids}
+            return [lines[product_id] for product_id in quantities]
+
+        meta = self.model._meta
+        quote = connection.ops.quote_name
+        cart_column, product_column, quantity_column = (meta.get_field(name).column for name in ("cart", "product", "quantity"))
+        sql = (
+            f"INSERT INTO {quote(meta.db_table)} ({quote(cart_column)}, {quote(product_column)}, {quote(quantity_column)}) "
+            f"VALUES {', '.join(['(%s, %s, %s)'] * len(product_ids))} "
+            f"ON CONFLICT ({quote(cart_column)}, {quote(product_column)}) "
+            f"DO UPDATE SET {quote(quantity_column)} = {quote(meta.db_table)}.{quote(quantity_column)} + EXCLUDED.{quote(quantity_column)} "
+            f"RETURNING {quote(meta.pk.column)}, {quote(product_column)}, {quote(quantity_column)}"
+        )
+        db_cart_id = meta.get_field("cart").get_db_prep_value(cart_id, connection)
+        params = []
+        for product_id in product_ids:
+            params += [db_cart_id, product_field.get_db_prep_value(product_id, connection), quantities[product_id]]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        to_python = product_field.target_field.to_python
+        lines = {
+            to_python(product_id): self.model.from_db(
+                self.db, ["id", "cart_id", "product_id", "quantity"], [pk, cart_id, to_python(product_id), quantity]
+            )
+            for pk, product_id, quantity in rows
+        }
+        return [lines[to_python(product_id)] for product_id in quantities]
+
+    def _add_with_retry(self, cart_id, product_id, quantity):
+        lines = self.filter(cart_id=cart_id, product_id=product_id)
+        with transaction.atomic(using=self.db):
+            if not lines.update(quantity=F("quantity") + quantity):
+                try:
+                    with transaction.atomic(using=self.db):
+                        return self.create(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                except IntegrityError:
+                    # A concurrent request inserted the line first
+                    lines.update(quantity=F("quantity") + quantity)
+            return lines.get()
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="cart_items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemManager()
+
+    class Meta:
+        constraints = [
+            # One line per product, quantities are incremented instead (see CartItemManager.add)
+            models.UniqueConstraint(fields=["cart", "product"], name="cartitem_cart_product_unique"),
+        ]
+
     def __str__(self):
         return f"{self.product} - {self.quantity}"
 
 
-class Order(models.Model):
+class OrderQuerySet(models.QuerySet):
+    def update_totals(self):
+        """Recompute the stored total_amount of these orders from their items, in one UPDATE."""
+        totals = (
+            OrderItem.objects.filter(order=OuterRef("pk"))
+            .values("order")
+            .annotate(total=Sum(F("quantity") * OrderItem.price_paid()))
+            .values("total")
+        )
+        return self.update(total_amount=Coalesce(Subquery(totals), Value(0.0)), updated_at=timezone.now())
+
+
+class Order(VersionedModel):
     ORDER_STATUS_CHOICES = (
         ('PENDING', 'Pending'),
         ('COMPLETED', 'Completed'),
@@ -94,20 +245,41 @@ class Order(models.Model):
     shipping_address = models.CharField(max_length=255, blank=True, null=True)
     payment_method = models.CharField(max_length=50, blank=True, null=True)
     tracking_number = models.CharField(max_length=50, blank=True, null=True)
+    # Sum of the items at the price paid, set at checkout and kept up to date by update_totals()
+    total_amount = models.FloatField(default=0.00)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of all orders (staff) and of a customer's orders
+            models.Index(fields=["creation_date", "id"], name="order_created_id_idx"),
+            models.Index(fields=["owner", "creation_date", "id"], name="order_owner_created_id_idx"),
+        ]
     
     def __str__(self):
         return f"Order #{self.id} - {self.owner.username}"
-    
-    @property
-    def total_amount(self):
-        items = self.order_items.all()
-        total = sum([item.quantity * item.product.price for item in items ])
-        return total
-    
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def snapshot_prices(self):
+        """Record the current price of the product on the items that have no unit_price yet."""
+        price = Product.objects.filter(pk=OuterRef("product_id")).values("price")
+        return self.filter(unit_price__isnull=True).update(unit_price=Subquery(price))
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="order_items")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    # Price of the product at checkout, empty for items ordered before it was recorded
+    unit_price = models.FloatField(blank=True, null=True)
+
+    objects = OrderItemQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.product} - {self.quantity}"
+
+    @staticmethod
+    def price_paid(prefix=""):
+        return Coalesce(F(f"{prefix}unit_price"), F(f"{prefix}product__price"))
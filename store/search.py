@@ -0,0 +1,152 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+
+# Created by migration 0007_product_search:
+# - PostgreSQL: a stored tsvector column generated from name (weight A) and description (weight B), with a GIN index
+# - SQLite: an FTS5 table kept in sync by the Product signals in store/signals.py
+SEARCH_VECTOR_COLUMN = "search_vector"
+FTS_TABLE = "store_product_fts"
+SEARCH_CONFIG = "english"
+
+# Created by migration 0008_product_name_trigrams:
+# - PostgreSQL: a pg_trgm GIN index on name
+# - SQLite: an FTS5 table with the trigram tokenizer, names are stored padded with spaces like pg_trgm pads words
+TRIGRAM_TABLE = "store_product_name_trgm"
+
+
+def search_products(queryset, terms):
+    """
+    Filter ``queryset`` down to the products matching ``terms`` and annotate ``search_rank`` (higher is better).
+    Returns None when the database has no full-text index, so callers can fall back to a plain search.
+    """
+    if connection.vendor == "postgresql":
+        column = f"{connection.ops.quote_name(Product._meta.db_table)}.{connection.ops.quote_name(SEARCH_VECTOR_COLUMN)}"
+        query = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        match = RawSQL(f"{column} @@ {query}", [terms], output_field=BooleanField())
+        rank = RawSQL(f"ts_rank_cd({column}, {query})", [terms], output_field=FloatField())
+        return queryset.alias(search_match=match).filter(search_match=True).annotate(search_rank=rank)
+
+    if connection.vendor == "sqlite":
+        tokens = re.findall(r"\w+", terms)
+        if not tokens:
+            # Still annotated, callers order by the rank
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField())).none()
+        # Quoting every token keeps FTS5 operators typed by users from being interpreted
+        query = " ".join(f'"{token}"' for token in tokens)
+        product_id = f"{connection.ops.quote_name(Product._meta.db_table)}.{connection.ops.quote_name(Product._meta.pk.column)}"
+        matches = RawSQL(f"SELECT product_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query])
+        # bm25() is lower for better matches, names weigh more than descriptions like on PostgreSQL
+        rank = RawSQL(
+            f"(SELECT -bm25({FTS_TABLE}, 0, 10, 1) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND product_id = {product_id})",
+            [query],
+            output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+    return None
+
+
+def suggest_products(term, limit=10):
+    """
+    Names and slugs of the products whose name starts like ``term`` or is close to it, best matches first.
+    Trigram similarity makes it tolerant to typos ("walet" finds "Leather wallet").
+    """
+    products = Product.objects.order_by()
+    name = f"{connection.ops.quote_name(Product._meta.db_table)}.{connection.ops.quote_name('name')}"
+
+    if connection.vendor == "postgresql":
+        # <% (word similarity) and ILIKE 'term%' are both served by the trigram index. Not name__istartswith,
+        # which compiles to UPPER(name) LIKE UPPER('term%') and can only be answered by scanning the table
+        pattern = re.sub(r"([\\%_])", r"\\\1", term) + "%"
+        prefix = RawSQL(f"{name} ILIKE %s", [pattern], output_field=BooleanField())
+        similar = RawSQL(f"%s <%% {name}", [term], output_field=BooleanField())
+        similarity = RawSQL(f"word_similarity(%s, {name})", [term], output_field=FloatField())
+        return list(
+            products.alias(prefix=prefix, similar=similar, similarity=similarity)
+            .filter(Q(prefix=True) | Q(similar=True))
+            .order_by("-similarity")
+            .values("name", "slug")[:limit]
+        )
+
+    suggestions = list(products.filter(name__istartswith=term).values("name", "slug")[:limit])
+    if connection.vendor != "sqlite" or len(suggestions) == limit:
+        return suggestions
+
+    trigrams = set()
+    for word in re.findall(r"\w+", term.lower()):
+        padded = f" {word} "
+        trigrams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    if not trigrams:
+        return suggestions
+
+    query = " OR ".join(f'"{trigram}"' for trigram in sorted(trigrams))
+    matches = RawSQL(
+        f"SELECT product_id FROM {TRIGRAM_TABLE} WHERE {TRIGRAM_TABLE} MATCH %s ORDER BY bm25({TRIGRAM_TABLE}) LIMIT %s",
+        [query, limit * 2],
+    )
+    product_id = f"{connection.ops.quote_name(Product._meta.db_table)}.{connection.ops.quote_name(Product._meta.pk.column)}"
+    rank = RawSQL(
+        f"(SELECT bm25({TRIGRAM_TABLE}) FROM {TRIGRAM_TABLE} WHERE {TRIGRAM_TABLE} MATCH %s AND product_id = {product_id})",
+        [query],
+        output_field=FloatField(),
+    )
+    seen = {suggestion["slug"] for suggestion in suggestions}
+    for suggestion in products.filter(pk__in=matches).alias(rank=rank).order_by("rank").values("name", "slug"):
+        if len(suggestions) == limit:
+            break
+        if suggestion["slug"] not in seen:
+            seen.add(suggestion["slug"])
+            suggestions.append(suggestion)
+    return suggestions
+
+
+############################################### SQLite index maintenance ###############################################
+
+def _db_id(pk):
+    return Product._meta.pk.get_db_prep_value(pk, connection)
+
+
+def index_products(products):
+    """Write ``products`` to the SQLite FTS table. PostgreSQL generates its column by itself."""
+    if connection.vendor != "sqlite":
+        return
+    products = list(products)
+    unindex_products([product.pk for product in products])
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {FTS_TABLE} (product_id, name, description) VALUES (%s, %s, %s)",
+            [(_db_id(product.pk), product.name, product.description) for product in products],
+        )
+        cursor.executemany(
+            f"INSERT INTO {TRIGRAM_TABLE} (product_id, name) VALUES (%s, %s)",
+            [(_db_id(product.pk), f" {product.name} ") for product in products],
+        )
+
+
+def unindex_products(pks):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for table in (FTS_TABLE, TRIGRAM_TABLE):
+            cursor.executemany(f"DELETE FROM {table} WHERE product_id = %s", [(_db_id(pk),) for pk in pks])
+
+
+def rebuild_search_index():
+    """Re-index every product, for data loaded with bulk_create/update() which bypass the signals."""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (product_id, name, description) SELECT id, name, description FROM {Product._meta.db_table}"
+        )
+        cursor.execute(f"DELETE FROM {TRIGRAM_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {TRIGRAM_TABLE} (product_id, name) SELECT id, ' ' || name || ' ' FROM {Product._meta.db_table}"
+        )
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .models import Category, Product, Review
+from .search import index_products, unindex_products
+
+# Sent with the ``products`` written by bulk_create()/bulk_update(), which do not send post_save
+products_bulk_saved = Signal()
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    index_products([instance])
+
+
+@receiver(products_bulk_saved, sender=Product)
+def index_bulk_saved_products(sender, products, **kwargs):
+    index_products(products)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    unindex_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def touch_category_products(sender, instance, created, **kwargs):
+    # Products embed their category
+    if not created:
+        Product.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver([post_save, post_delete], sender=Review)
+def touch_reviewed_product(sender, instance, **kwargs):
+    # Products show their review count
+    Product.touch(instance.product_id)
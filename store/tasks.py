@@ -0,0 +1,65 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cart_storage import get_cart_storage
+from .models import Cart, CartItem
+
+
+# Housekeeping jobs. They are plain functions so they can run from a management command, cron or any task
+# scheduler (a Celery beat entry only has to call them).
+
+
+def purge_carts_in_batches(max_age=None, batch_size=1000, pause=0.0, max_batches=None):
+    """
+    Delete the carts nobody touched for ``max_age`` (ABANDONED_CART_AGE by default), ``batch_size`` carts
+    per short transaction, and yield ``(carts, items)`` deleted by every batch.
+
+    Carts are walked in (date_created, id) order along the date_created index. Carts that were created long
+    ago but are still in use are stepped over, so each batch starts where the previous one stopped. Stopping
+    at any point loses nothing: the next run starts over and finds only what is left.
+    """
+    cutoff = timezone.now() - (settings.ABANDONED_CART_AGE if max_age is None else max_age)
+    candidates = Cart.objects.filter(date_created__lt=cutoff).order_by("date_created", "id")
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        batch = list(candidates.values_list("date_created", "id")[:batch_size])
+        if not batch:
+            return
+        last_created, last_id = batch[-1]
+        candidates = candidates.filter(Q(date_created__gt=last_created) | Q(date_created=last_created, id__gt=last_id))
+
+        with transaction.atomic():
+            # Checked again under lock, a line may have been added since the batch was read
+            abandoned = list(
+                Cart.objects.select_for_update()
+                .filter(id__in=[cart_id for _, cart_id in batch], updated_at__lt=cutoff)
+                .values_list("id", flat=True)
+            )
+            # Nothing listens to cart deletions, skip the collector like checkout does
+            items = CartItem.objects.filter(cart_id__in=abandoned)._raw_delete(CartItem.objects.db)
+            carts = Cart.objects.filter(id__in=abandoned)._raw_delete(Cart.objects.db)
+
+        batches += 1
+        yield carts, items
+        if pause:
+            # Leave room for the regular traffic between two batches
+            time.sleep(pause)
+
+
+def purge_abandoned_carts(**options):
+    """Scheduler entry point, purges every abandoned cart and returns the number of carts and items deleted."""
+    carts = items = 0
+    for batch_carts, batch_items in purge_carts_in_batches(**options):
+        carts += batch_carts
+        items += batch_items
+    return carts, items
+
+
+def flush_carts(batch_size=1000):
+    """Scheduler entry point, writes the carts changed in the cache since the last run to the database."""
+    return get_cart_storage().flush(batch_size=batch_size)
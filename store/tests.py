@@ -1,3 +1,130 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from .models import Cart, CartItem, Category, Order, OrderItem, Product
+from .search import search_products
+from .tasks import purge_abandoned_carts
+
+User = get_user_model()
 
 # Create your tests here.
+
+class BackfillOrderTotalsTestCase(TestCase):
+    def test_backfill_prices_items_and_totals_orders(self):
+        user = User.objects.create_user(email="buyer@example.com", password="password", username="buyer")
+        product = Product.objects.create(name="Product", description="-", old_price=10, discount=True, inventory=10)
+        priced = Product.objects.create(name="Priced", description="-", old_price=5, inventory=10)
+        orders = Order.objects.bulk_create([Order(owner=user) for _ in range(3)])
+        for order in orders:
+            OrderItem.objects.create(order=order, product=product, quantity=2)
+            # Already snapshotted at an older price, kept as is
+            OrderItem.objects.create(order=order, product=priced, quantity=1, unit_price=4)
+
+        call_command("backfill_order_totals", batch_size=2, stdout=StringIO())
+
+        self.assertFalse(OrderItem.objects.filter(unit_price__isnull=True).exists())
+        self.assertEqual(set(OrderItem.objects.filter(product=priced).values_list("unit_price", flat=True)), {4})
+        for order in Order.objects.all():
+            self.assertAlmostEqual(order.total_amount, 2 * 7 + 4)
+
+
+class PurgeAbandonedCartsTestCase(TestCase):
+    def setUp(self):
+        product = Product.objects.create(name="Product", description="-", inventory=10)
+        long_ago = timezone.now() - timedelta(days=60)
+        self.abandoned = Cart.objects.bulk_create([Cart() for _ in range(5)])
+        self.in_use = Cart.objects.create()
+        self.recent = Cart.objects.create()
+        for cart in [*self.abandoned, self.in_use, self.recent]:
+            CartItem.objects.create(cart=cart, product=product)
+        Cart.objects.exclude(pk=self.recent.pk).update(date_created=long_ago, updated_at=long_ago)
+        # Created long ago (after the abandoned ones), but a line changed since
+        Cart.objects.filter(pk=self.in_use.pk).update(date_created=long_ago + timedelta(days=1))
+        Cart.touch(self.in_use.pk)
+
+    def test_purge_deletes_only_abandoned_carts(self):
+        carts, items = purge_abandoned_carts(max_age=timedelta(days=30), batch_size=2)
+
+        self.assertEqual((carts, items), (5, 5))
+        self.assertEqual(set(Cart.objects.values_list("pk", flat=True)), {self.in_use.pk, self.recent.pk})
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_interrupted_purge_resumes(self):
+        call_command("purge_carts", days=30, batch_size=2, max_batches=1, stdout=StringIO())
+        self.assertEqual(Cart.objects.count(), 5)
+
+        output = StringIO()
+        call_command("purge_carts", days=30, batch_size=2, stdout=output)
+        self.assertEqual(Cart.objects.count(), 2)
+        self.assertIn("Deleted 3 carts and 3 items", output.getvalue())
+
+
+class ProductImportExportTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(title="Shoes")
+        self.existing = Product.objects.create(name="Old Runner", description="Old", old_price=50, inventory=5)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def test_import_upserts_on_slug(self):
+        path = self.write("products.csv", "\n".join([
+            "slug,name,description,category,old_price,discount,inventory",
+            "old-runner,,,shoes,40,true,",
+            ",Trail Runner,Grippy,shoes,80,false,12",
+            ",Ghost,,unknown-category,10,false,1",
+            "missing-name,,,,10,false,1",
+        ]))
+        stdout, stderr = StringIO(), StringIO()
+        call_command("import_products", path, chunk_size=2, stdout=stdout, stderr=stderr)
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.old_price, self.existing.discount), ("Old Runner", 40, True))
+        self.assertEqual((self.existing.inventory, self.existing.category), (5, self.category))
+        self.assertAlmostEqual(self.existing.price, 28)
+
+        trail = Product.objects.get(slug="trail-runner")
+        self.assertEqual((trail.inventory, trail.category), (12, self.category))
+        self.assertEqual(list(search_products(Product.objects.all(), "grippy")), [trail])
+
+        self.assertIn("Created 1, updated 1 and skipped 2", stdout.getvalue())
+        self.assertIn("Row 3 skipped: unknown category", stderr.getvalue())
+
+    def test_ambiguous_slug_is_not_imported(self):
+        twin = Product.objects.create(name="Old Runner", description="Twin", old_price=60, inventory=2)
+        path = self.write("products.csv", "slug,old_price\nold-runner,10\n")
+        stdout, stderr = StringIO(), StringIO()
+        call_command("import_products", path, stdout=stdout, stderr=stderr)
+
+        self.assertEqual(Product.objects.get(pk=self.existing.pk).old_price, 50)
+        self.assertEqual(Product.objects.get(pk=twin.pk).old_price, 60)
+        self.assertIn("Created 0, updated 0 and skipped 1", stdout.getvalue())
+        self.assertIn("Row 1 skipped: slug 'old-runner' matches 2 products", stderr.getvalue())
+
+    def test_export_can_be_imported_back(self):
+        Product.objects.create(name="Sandal", description="Summer", old_price=20, inventory=3, category=self.category)
+        path = os.path.join(self.directory.name, "products.jsonl")
+        call_command("export_products", path, stderr=StringIO())
+
+        with open(path, encoding="utf-8") as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual({row["slug"] for row in rows}, {"old-runner", "sandal"})
+        self.assertEqual(next(row for row in rows if row["slug"] == "sandal")["category"], "shoes")
+
+        Product.objects.all().delete()
+        call_command("import_products", path, stdout=StringIO())
+        self.assertEqual(Product.objects.get(slug="sandal").category, self.category)
+        self.assertEqual(Product.objects.count(), 2)